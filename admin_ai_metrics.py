@@ -0,0 +1,115 @@
+# =============================================
+# admin_ai_metrics.py（管理者用：AI 呼び出しの所要時間・トークン集計）
+# =============================================
+
+import streamlit as st
+import pandas as pd
+
+from ai_metrics import get_metrics_store, load_samples
+from correction_cache import get_correction_cache
+
+PERIODS = {"直近1時間": 1, "直近24時間": 24, "直近7日": 24 * 7}
+RECENT_FAILURES = 20   # 「直近の失敗」に出す件数
+
+FEATURE_LABELS = {
+    "generate_question": "出題生成",
+    "question_pool_refill": "出題プール補充",
+    "correct_essay": "添削",
+    "ocr_and_correct": "読み取り＋添削",
+    "extract_text": "画像読み取り",
+    "transcribe_audio": "音声認識",
+    "get_ai_reply": "英会話返答",
+    "synthesize_speech": "音声合成",
+}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_frame(hours: int) -> pd.DataFrame:
+    """サンプルを DataFrame に（1分キャッシュ：ビューを開くたびに全件読まない）"""
+    df = pd.DataFrame(load_samples(hours))
+    # cached_tokens / error を記録し始める前のサンプルは 0 / 空扱い
+    df["cached_tokens"] = df["cached_tokens"].fillna(0) if "cached_tokens" in df else 0
+    df["error"] = df["error"].fillna("") if "error" in df else ""
+    return df
+
+
+def recent_failures(df: pd.DataFrame, limit: int = RECENT_FAILURES) -> pd.DataFrame:
+    """失敗したサンプルを新しい順に limit 件（元の例外の型とメッセージつき）"""
+    failed = df[df["outcome"] != "ok"].sort_values("at", ascending=False).head(limit)
+    return pd.DataFrame({
+        "時刻": failed["at"],
+        "機能": failed["feature"].map(lambda f: FEATURE_LABELS.get(f, f)),
+        "結果": failed["outcome"],
+        "エラー": failed["error"],
+    })
+
+
+def summarize_by_feature(df: pd.DataFrame) -> pd.DataFrame:
+    """機能ごとの件数・p50/p95・トークン・キャッシュ率・失敗率"""
+    grouped = df.groupby("feature")
+    summary = pd.DataFrame({
+        "件数": grouped.size(),
+        "p50 全体(ms)": grouped["wall_ms"].quantile(0.5),
+        "p95 全体(ms)": grouped["wall_ms"].quantile(0.95),
+        "p50 待ち(ms)": grouped["queue_ms"].quantile(0.5),
+        "p95 待ち(ms)": grouped["queue_ms"].quantile(0.95),
+        "入力トークン計": grouped["prompt_tokens"].sum(),
+        "キャッシュ率": grouped["cached_tokens"].sum() / grouped["prompt_tokens"].sum().where(lambda n: n > 0),
+        "出力トークン計": grouped["completion_tokens"].sum(),
+        "失敗率": grouped["outcome"].apply(lambda s: (s != "ok").mean()),
+    })
+    summary.index = summary.index.map(lambda f: FEATURE_LABELS.get(f, f))
+    summary.index.name = "機能"
+    return summary.sort_values("p95 全体(ms)", ascending=False)
+
+
+def show_ai_metrics():
+    period = st.radio("期間", list(PERIODS.keys()), horizontal=True, key="ai_metrics_period")
+    if st.button("🔄 最新を読み込む", key="ai_metrics_reload"):
+        _load_frame.clear()
+        get_metrics_store().flush()
+
+    try:
+        df = _load_frame(PERIODS[period])
+    except Exception as e:
+        st.error(f"❌ メトリクス読み込みエラー: {e}")
+        return
+
+    if df.empty:
+        st.info("この期間の記録はまだありません。")
+    else:
+        failed = (df["outcome"] != "ok").mean()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("呼び出し数", f"{len(df):,}")
+        c2.metric("p95 所要時間", f"{df['wall_ms'].quantile(0.95) / 1000:.1f} 秒")
+        c3.metric("合計トークン", f"{int(df['prompt_tokens'].sum() + df['completion_tokens'].sum()):,}")
+        c4.metric("失敗率", f"{failed:.1%}")
+
+        st.subheader("機能別（p95 の遅い順）")
+        st.dataframe(
+            summarize_by_feature(df),
+            use_container_width=True,
+            column_config={
+                "失敗率": st.column_config.NumberColumn(format="%.3f"),
+                "キャッシュ率": st.column_config.NumberColumn(format="%.2f"),
+                **{c: st.column_config.NumberColumn(format="%d") for c in (
+                    "p50 全体(ms)", "p95 全体(ms)", "p50 待ち(ms)", "p95 待ち(ms)", "入力トークン計", "出力トークン計"
+                )},
+            },
+        )
+
+        if failed:
+            st.subheader("直近の失敗")
+            st.dataframe(recent_failures(df), use_container_width=True, hide_index=True)
+
+        st.subheader("モデル別トークン")
+        by_model = df.groupby(df["model"].fillna("-"))[["prompt_tokens", "cached_tokens", "completion_tokens"]].sum()
+        st.dataframe(by_model.rename(columns={"prompt_tokens": "入力", "cached_tokens": "うちキャッシュ", "completion_tokens": "出力"}),
+                     use_container_width=True)
+
+    # 🧠 添削キャッシュ（このサーバープロセス分）
+    stats = get_correction_cache().stats()
+    st.caption(
+        f"添削キャッシュ（このプロセス）：ヒット率 {stats['hit_rate']:.0%} "
+        f"（メモリ {stats['memory_hits']} / 保存 {stats['store_hits']} / ミス {stats['misses']}）"
+    )
@@ -0,0 +1,257 @@
+# =============================================
+# admin_batch_correction.py（管理者用：英作文の一括添削）
+# =============================================
+# 紙で集めた答案をまとめて添削する。
+#   - ZIP：答案画像（ファイル名の先頭が会員番号。例 1001.jpg / 1001_山田.png）
+#   - CSV：「会員番号」「英文」列（任意で「お題」列）
+# 読み取り（OCR）と添削は同時実行数を絞ったスレッドプールで並列に行い、
+# 結果は CSV / Excel でダウンロードでき、各生徒の essay_history にまとめて書き込む。
+
+import hashlib
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from english_corrector import build_correction_prompt, correct_essay, template_for_mode
+from correction_cache import correction_cache_key
+from firebase_utils import FIRESTORE_BATCH_LIMIT, USERS, db, fetch_existing_ids
+from ocr_service import encode_image_for_ocr, extract_text_from_image_bytes
+from services import env_int
+
+BATCH_MAX_WORKERS = env_int("BATCH_CORRECTION_WORKERS", 4)   # 同時に処理する答案数
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+BATCH_MODES = ["自由添削", "和文英訳", "自由英作"]
+RESULT_COLUMNS = ["会員番号", "元データ", "お題", "英文", "添削結果", "状態"]
+CSV_ENCODINGS = ("utf-8-sig", "cp932")
+
+
+# ==================================================
+# 📥 入力の読み込み
+# ==================================================
+def _member_id_from_filename(name: str) -> str:
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem.split("_")[0].strip()
+
+
+def load_zip_items(zip_file) -> list[dict]:
+    """ZIP 内の画像 → [{member_id, source, image}]（フォルダ・隠しファイルは無視）"""
+    items = []
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or base.startswith(".") or "__MACOSX" in name:
+                continue
+            if not base.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            items.append({"member_id": _member_id_from_filename(base), "source": base, "image": zf.read(info)})
+    return items
+
+
+def _read_csv(csv_file) -> pd.DataFrame:
+    """UTF-8（BOM 付き可）で読めなければ Excel 書き出しの Shift_JIS（cp932）で読み直す"""
+    for encoding in CSV_ENCODINGS:
+        csv_file.seek(0)
+        try:
+            return pd.read_csv(csv_file, dtype=str, encoding=encoding).fillna("")
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("CSV の文字コードを判別できません（UTF-8 または Shift_JIS で保存してください）")
+
+
+def load_csv_items(csv_file) -> list[dict]:
+    """CSV → [{member_id, source, essay, question?}]"""
+    df = _read_csv(csv_file)
+    df.columns = [c.strip() for c in df.columns]
+    if "会員番号" not in df.columns or "英文" not in df.columns:
+        raise ValueError("CSV に『会員番号』『英文』列が必要です")
+    items = []
+    for i, row in enumerate(df.to_dict("records"), start=2):
+        item = {"member_id": row["会員番号"].strip(), "source": f"{i}行目", "essay": row["英文"].strip()}
+        if row.get("お題", "").strip():
+            item["question"] = row["お題"].strip()
+        items.append(item)
+    return items
+
+
+# ==================================================
+# ✏️ 1件分の処理（ワーカースレッドで実行：st.* は呼ばない）
+# ==================================================
+def correct_item(item: dict, mode_type: str, question: str) -> dict:
+    question = item.get("question", question)
+    essay = item.get("essay", "")
+
+    # 会員番号が空だと保存先が決まらないので、読み取り・添削（課金）の前に対象外にする
+    if not item["member_id"]:
+        return _result(item, question, essay, "", "会員番号なし")
+
+    if item.get("image") is not None:
+        try:
+            essay = extract_text_from_image_bytes(encode_image_for_ocr(item["image"]))
+        except Exception as e:
+            return _result(item, question, "", str(e), "読取エラー")
+
+    if not essay:
+        return _result(item, question, "", "", "英文なし")
+
+    template = template_for_mode(mode_type)
+    try:
+        correction = correct_essay(
+            build_correction_prompt(template, question, essay),
+            cache_key=correction_cache_key(template, question, essay),
+        )
+    except Exception as e:
+        return _result(item, question, essay, str(e), "添削エラー")
+    return _result(item, question, essay, correction, "OK")
+
+
+def _result(item: dict, question: str, essay: str, correction: str, status: str) -> dict:
+    return {
+        "会員番号": item["member_id"],
+        "元データ": item["source"],
+        "お題": question,
+        "英文": essay,
+        "添削結果": correction,
+        "状態": status,
+    }
+
+
+def run_batch(items: list[dict], mode_type: str, question: str, on_progress=None) -> pd.DataFrame:
+    """同時実行数 BATCH_MAX_WORKERS で全件を添削（on_progress(done, total) で進捗を通知）"""
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch-correction") as pool:
+        futures = {pool.submit(correct_item, item, mode_type, question): i for i, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = _result(items[i], question, items[i].get("essay", ""), f"❌ {e}", "エラー")
+            if on_progress:
+                on_progress(done, len(items))
+
+    # 入力と同じ順番で返す
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+# ==================================================
+# 💾 履歴への書き込み（500件ずつ WriteBatch）
+# ==================================================
+def save_batch_history(df: pd.DataFrame, mode_type: str) -> tuple[int, list[str]]:
+    """添削できた行を各生徒の essay_history へ。→ (書き込み件数, 未登録の会員番号)"""
+    # USERS.document("") はコレクション自体を指してしまうため、空の会員番号は API に渡さない
+    ok = df[(df["状態"] == "OK") & (df["会員番号"] != "")]
+    existing = fetch_existing_ids(ok["会員番号"].unique()) if len(ok) else set()
+    unknown = sorted(set(ok["会員番号"]) - existing)
+    rows = ok[ok["会員番号"].isin(existing)]
+
+    now = datetime.now()
+    records = rows.to_dict("records")
+    for i in range(0, len(records), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for r in records[i:i + FIRESTORE_BATCH_LIMIT]:
+            ref = USERS.document(r["会員番号"]).collection("essay_history").document()
+            batch.set(ref, {
+                "mode": mode_type,
+                "question": r["お題"],
+                "user_input": r["英文"],
+                "correction": r["添削結果"],
+                "source": "batch",
+                "status": "corrected",
+                "timestamp": now,
+            })
+        batch.commit()
+    return len(records), unknown
+
+
+def _to_excel_bytes(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="添削結果")
+    return buf.getvalue()
+
+
+# ==================================================
+# 🖥️ 画面
+# ==================================================
+def show_batch_correction():
+    st.caption(
+        "ZIP：答案画像（ファイル名の先頭を会員番号に。例 1001.jpg / 1001_山田.png）　"
+        "CSV：『会員番号』『英文』列（任意で『お題』列）"
+    )
+    upload = st.file_uploader("📦 答案 ZIP または CSV", type=["zip", "csv"], key="batch_upload")
+    mode_type = st.radio("添削の種類", BATCH_MODES, horizontal=True, key="batch_mode")
+    question = ""
+    if mode_type != "自由添削":
+        question = st.text_area("お題（CSV に『お題』列がある行はそちらを優先）", height=80, key="batch_question")
+
+    # 🔁 結果はアップロードの中身ごとに持つ（別のファイルに替えたら前回の結果は出さない）
+    upload_key = hashlib.sha256(upload.getvalue()).hexdigest() if upload is not None else None
+    if (st.session_state.get("batch_result") or {}).get("upload_key") != upload_key:
+        st.session_state.pop("batch_result", None)
+
+    if upload is None:
+        return
+
+    try:
+        items = load_zip_items(upload) if upload.name.lower().endswith(".zip") else load_csv_items(upload)
+    except Exception as e:
+        st.error(f"❌ ファイル読み込みエラー: {e}")
+        return
+
+    st.write(f"対象：{len(items)} 件")
+    if not items:
+        st.warning("添削対象が見つかりませんでした。")
+        return
+    no_id = [i["source"] for i in items if not i["member_id"]]
+    if no_id:
+        st.warning(f"⚠ 会員番号が空のため添削しません（{len(no_id)} 件）：{', '.join(no_id)}")
+
+    if st.button("✏️ 一括添削を開始", key="batch_start"):
+        if mode_type != "自由添削" and not question.strip() and not all(i.get("question") for i in items):
+            st.warning("⚠ お題を入力してください。")
+            return
+        progress = st.progress(0.0, text=f"0 / {len(items)} 件")
+
+        def _on_progress(done, total):
+            progress.progress(done / total, text=f"{done} / {total} 件")
+
+        df = run_batch(items, mode_type, question.strip(), on_progress=_on_progress)
+        written, unknown = save_batch_history(df, mode_type)
+        st.session_state["batch_result"] = {"upload_key": upload_key, "df": df, "written": written, "unknown": unknown}
+
+    result = st.session_state.get("batch_result")
+    if not result:
+        return
+
+    df = result["df"]
+    skipped = int((df["状態"] == "会員番号なし").sum())
+    failed = int((df["状態"] != "OK").sum()) - skipped
+    st.success(f"✅ 添削完了：{len(df) - failed - skipped} 件（履歴に保存 {result['written']} 件）")
+    if skipped:
+        st.warning(f"⚠ 会員番号が空の {skipped} 件はスキップしました")
+    if failed:
+        st.warning(f"⚠ {failed} 件は添削できませんでした（状態列を確認してください）")
+    if result["unknown"]:
+        st.warning(f"⚠ 未登録の会員番号（履歴には保存していません）：{', '.join(result['unknown'])}")
+
+    st.dataframe(df, use_container_width=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M")
+    c1, c2 = st.columns(2)
+    c1.download_button(
+        "⬇️ CSV でダウンロード",
+        df.to_csv(index=False).encode("utf-8-sig"),
+        file_name=f"一括添削_{stamp}.csv",
+        mime="text/csv",
+    )
+    c2.download_button(
+        "⬇️ Excel でダウンロード",
+        _to_excel_bytes(df),
+        file_name=f"一括添削_{stamp}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
@@ -4,14 +4,13 @@
 
 import streamlit as st
 from datetime import datetime, timezone
-from streamlit_autorefresh import st_autorefresh
 import re
 import json
 from streamlit.components.v1 import html as components_html
 from textwrap import dedent
 import pytz
+from firebase_utils import db  # gRPC の fork 設定のため firestore より先に import
 from firebase_admin import firestore
-from firebase_utils import db
 
 
 # ==================================================
@@ -342,83 +341,10 @@ def send_message(target_type: str, user_id: str = None, grade: str = None, class
 
 
 # ==================================================
-# 🖥️ 管理者用チャットUI
+# 🔹 送信先ごとのメッセージ履歴（この部分だけを定期再実行）
 # ==================================================
-def show_admin_chat(initial_student_id=None):
-    st.title("💬 管理者チャット管理")
-
-    if not st.session_state.get("just_opened_from_inbox"):
-        st_autorefresh(interval=5000, key="admin_chat_refresh")
-    else:
-        st.session_state["just_opened_from_inbox"] = False
-    
-        # ===== 受信ボックスからの遷移処理 =====
-    if "selected_student_id" in st.session_state and st.session_state["selected_student_id"]:
-        initial_student_id = st.session_state["selected_student_id"]
-
-    students = get_all_students()
-    if not students:
-        st.warning("生徒データが見つかりません。")
-        return
-
-    pre_selected_id = initial_student_id if initial_student_id else None
-
-    st.sidebar.markdown("### 📤 送信先設定")
-    target_type = st.sidebar.radio("送信先タイプを選択", ["個人", "全員", "学年", "クラス"], horizontal=False)
-
-    selected_id = None
-    grade = None
-    class_name = None
-
-    if target_type == "個人":
-        default_value = pre_selected_id if pre_selected_id else ""
-        search_id = st.sidebar.text_input("🔎 チャット相手を検索（会員番号）", value=default_value, key="search_member_id").strip()
-
-        matched = []
-        if search_id:
-            exact = [s for s in students if s["id"] == search_id]
-            matched = exact if exact else [s for s in students if s["id"].startswith(search_id)]
-
-        if matched:
-            if len(matched) == 1:
-                selected_id = matched[0]["id"]
-                st.sidebar.success(f"選択中：{selected_id}（{matched[0]['name']}）")
-            else:
-                selected_id = st.sidebar.selectbox(
-                    "候補から選択",
-                    [s["id"] for s in matched],
-                    format_func=lambda x: f"{x}：{next((s['name'] for s in matched if s['id']==x), x)}"
-                )
-        else:
-            if search_id:
-                st.sidebar.warning("該当する会員番号が見つかりません。")
-
-        if selected_id:
-            u = next((s for s in students if s["id"] == selected_id), None)
-            grade = u["grade"] if u else None
-            class_name = (u.get("class_code") or u.get("class")) if u else None
-
-    elif target_type == "学年":
-        grade = st.sidebar.selectbox("学年を選択", ["中1", "中2", "中3", "高1", "高2", "高3"])
-
-    elif target_type == "クラス":
-        class_options = {
-            (s.get("class_code") or s.get("class")): s.get("class") or s.get("class_code")
-            for s in students
-            if s.get("class_code") or s.get("class")
-        }
-        if class_options:
-            class_code = st.sidebar.selectbox(
-                "クラスを選択（コード＋名称）",
-                sorted(class_options.keys()),
-                format_func=lambda x: f"{x}：{class_options[x]}"
-            )
-            class_name = class_code
-            for s in students:
-                if s.get("class_code") == class_code or s.get("class") == class_code:
-                    grade = s.get("grade")
-                    break
-
+def _show_chat_history(target_type: str, students: list, selected_id: str = None, grade: str = None,
+                       class_name: str = None, limit: int = 50):
     #################個人宛####################
 
     if target_type == "個人" and selected_id:
@@ -558,14 +484,6 @@ def show_admin_chat(initial_student_id=None):
                     unsafe_allow_html=True
                 )
 
-
-
-    # --- 以下（クラス宛、全員宛、学年宛、送信欄）は変更なし ---
-    # （元のコードのままでOK）
-
-
-
-
     # --- クラス宛履歴 ---
     elif target_type == "クラス" and class_name:
         st.subheader(f"👥 {class_name} 宛メッセージ履歴")
@@ -666,7 +584,7 @@ def show_admin_chat(initial_student_id=None):
 
         # メッセージ取得（最新→古い）
         all_msgs = []
-        for d in ref.order_by("timestamp", direction="DESCENDING").limit(limit).stream():
+        for d in all_ref.order_by("timestamp", direction="DESCENDING").limit(limit).stream():
             m = d.to_dict()
             if m:
                 all_msgs.append(m)
@@ -833,6 +751,86 @@ def show_admin_chat(initial_student_id=None):
         st.divider()
 
 
+# ==================================================
+# 🖥️ 管理者用チャットUI
+# ==================================================
+def show_admin_chat(initial_student_id=None, refresh_ms: int = 5000):
+    """refresh_ms: 自動更新間隔（ミリ秒）。None / 0 で自動更新しない"""
+    st.title("💬 管理者チャット管理")
+
+    # 受信ボックスからの遷移フラグは1回使ったら解除
+    st.session_state["just_opened_from_inbox"] = False
+
+    # ===== 受信ボックスからの遷移処理 =====
+    if "selected_student_id" in st.session_state and st.session_state["selected_student_id"]:
+        initial_student_id = st.session_state["selected_student_id"]
+
+    students = get_all_students()
+    if not students:
+        st.warning("生徒データが見つかりません。")
+        return
+
+    pre_selected_id = initial_student_id if initial_student_id else None
+
+    st.sidebar.markdown("### 📤 送信先設定")
+    target_type = st.sidebar.radio("送信先タイプを選択", ["個人", "全員", "学年", "クラス"], horizontal=False)
+
+    selected_id = None
+    grade = None
+    class_name = None
+
+    if target_type == "個人":
+        default_value = pre_selected_id if pre_selected_id else ""
+        search_id = st.sidebar.text_input("🔎 チャット相手を検索（会員番号）", value=default_value, key="search_member_id").strip()
+
+        matched = []
+        if search_id:
+            exact = [s for s in students if s["id"] == search_id]
+            matched = exact if exact else [s for s in students if s["id"].startswith(search_id)]
+
+        if matched:
+            if len(matched) == 1:
+                selected_id = matched[0]["id"]
+                st.sidebar.success(f"選択中：{selected_id}（{matched[0]['name']}）")
+            else:
+                selected_id = st.sidebar.selectbox(
+                    "候補から選択",
+                    [s["id"] for s in matched],
+                    format_func=lambda x: f"{x}：{next((s['name'] for s in matched if s['id']==x), x)}"
+                )
+        else:
+            if search_id:
+                st.sidebar.warning("該当する会員番号が見つかりません。")
+
+        if selected_id:
+            u = next((s for s in students if s["id"] == selected_id), None)
+            grade = u["grade"] if u else None
+            class_name = (u.get("class_code") or u.get("class")) if u else None
+
+    elif target_type == "学年":
+        grade = st.sidebar.selectbox("学年を選択", ["中1", "中2", "中3", "高1", "高2", "高3"])
+
+    elif target_type == "クラス":
+        class_options = {
+            (s.get("class_code") or s.get("class")): s.get("class") or s.get("class_code")
+            for s in students
+            if s.get("class_code") or s.get("class")
+        }
+        if class_options:
+            class_code = st.sidebar.selectbox(
+                "クラスを選択（コード＋名称）",
+                sorted(class_options.keys()),
+                format_func=lambda x: f"{x}：{class_options[x]}"
+            )
+            class_name = class_code
+            for s in students:
+                if s.get("class_code") == class_code or s.get("class") == class_code:
+                    grade = s.get("grade")
+                    break
+
+    # 🔁 履歴だけを fragment で再実行（サイドバーの選択・送信欄はそのまま）
+    run_every = refresh_ms / 1000 if refresh_ms else None
+    st.fragment(_show_chat_history, run_every=run_every)(target_type, students, selected_id, grade, class_name)
 
     # --- 送信欄 ---
     st.markdown("---")
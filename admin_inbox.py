@@ -35,11 +35,16 @@ def get_all_students():
 # ==================================================
 
 def count_unread_messages():
-    students = get_all_students()
-    unread_count = 0
-
     # ✅ 現在ログインしている管理者のIDを取得
     current_admin_id = st.session_state.get("member_id")
+    return _count_unread_messages(current_admin_id)
+
+
+# 生徒数ぶんのクエリが走るため、再描画のたびには数え直さない
+@st.cache_data(ttl=30, show_spinner=False)
+def _count_unread_messages(current_admin_id):
+    students = get_all_students()
+    unread_count = 0
 
     for s in students:
         user_id = s["id"]
@@ -119,10 +124,17 @@ def get_latest_received_messages():
 # ==================================================
 # 🖥️ 管理者用 受信ボックスUI（既読も残る）
 # ==================================================
-def show_admin_inbox():
+def show_admin_inbox(refresh_ms: int = None):
+    """refresh_ms: 一覧の自動更新間隔（ミリ秒）。None / 0 で自動更新しない"""
     st.title("📥 受信ボックス（生徒・保護者からのメッセージ）")
     st.caption("未読は赤色、既読はグレーで表示されます。")
 
+    # 🔁 一覧だけを fragment で再実行
+    run_every = refresh_ms / 1000 if refresh_ms else None
+    st.fragment(_show_inbox_list, run_every=run_every)()
+
+
+def _show_inbox_list():
     messages = get_latest_received_messages()
 
     if not messages:
@@ -5,7 +5,6 @@
 import streamlit as st
 from datetime import datetime, time, timezone
 import pytz
-from streamlit_autorefresh import st_autorefresh
 
 # ✅ Firebase は共通ユーティリティから利用
 from firebase_utils import db
@@ -73,7 +72,8 @@ def process_scheduled_messages():
 # ------------------------------------------------
 # 📅 予約送信画面UI
 # ------------------------------------------------
-def show_admin_schedule():
+def show_admin_schedule(refresh_ms: int = 10000):
+    """refresh_ms: 送信判定の自動更新間隔（ミリ秒）。None / 0 で自動更新しない"""
     st.title("⏰ メッセージ送信予約")
     st.write("未来の日時を指定してメッセージを予約送信できます。")
 
@@ -108,8 +108,28 @@ def show_admin_schedule():
             st.success(f"✅ {send_at_jst.strftime('%Y-%m-%d %H:%M')} に送信を予約しました。")
             st.balloons()
 
-    # 🔁 定期チェック（10秒ごとに送信判定）
-    st_autorefresh(interval=10000, key="schedule_refresh")
+    # 🔁 定期チェック（refresh_ms ごとに送信判定）：この欄だけを fragment で再実行
+    run_every = refresh_ms / 1000 if refresh_ms else None
+    st.fragment(_show_schedule_status, run_every=run_every)()
+
+
+def _show_schedule_status():
+    """送信判定を実行し、最終チェック時刻を表示する（入力欄は再実行しない）"""
+    process_scheduled_messages()
+    jst = pytz.timezone("Asia/Tokyo")
+    st.caption(f"🔁 最終チェック：{datetime.now(jst).strftime('%H:%M:%S')}")
+
+
+def process_scheduled_messages_throttled(min_interval_sec: int = 30):
+    """
+    送信予約画面を開いていなくても予約が送られるよう、管理者ページの再描画時に
+    min_interval_sec 秒に1回だけ process_scheduled_messages() を実行する
+    """
+    now = datetime.now(timezone.utc)
+    last = st.session_state.get("_schedule_checked_at")
+    if last and (now - last).total_seconds() < min_interval_sec:
+        return
+    st.session_state["_schedule_checked_at"] = now
     process_scheduled_messages()
 
 # ------------------------------------------------
@@ -185,11 +205,11 @@ def show_scheduled_message_list():
 
 
 # =============================================
-# メインエントリーポイント（変更なし）
+# メインエントリーポイント
 # =============================================
-def show_schedule_main():
+def show_schedule_main(refresh_ms: int = 10000):
     tab1, tab2 = st.tabs(["📩 送信予約登録", "📋 予約一覧"])
     with tab1:
-        show_admin_schedule()
+        show_admin_schedule(refresh_ms)
     with tab2:
         show_scheduled_message_list()
@@ -0,0 +1,315 @@
+# =============================================
+# ai_gateway.py（OpenAI 呼び出しの共通窓口）
+# =============================================
+# 出題・添削・OCR・Whisper・英会話のモデル呼び出しはすべてここを通す。
+#   - 接続プール   : services の共有 OpenAI クライアント（httpx プール）を使い回す
+#   - 流量制限     : プロセス全体のトークンバケット＋同時実行数の上限
+#   - 公平性       : 待ち行列はユーザーごとに分け、順番に1件ずつ通す（1人の連打で他の生徒が待たされない）
+#   - 再試行       : 429 / 5xx / 通信エラーはジッター付き指数バックオフで再試行
+#   - 締切         : 待ち時間＋再試行を含めて deadline 秒を超えたら打ち切る
+# 失敗は AIGatewayError（画面にそのまま出せる日本語メッセージ）で返す。
+#
+# ※ Streamlit のスクリプトは同期実行なので、async ではなくスレッドセーフな同期実装にしている。
+
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from ai_metrics import add_usage_from, current_record, track
+from services import env_int, get, get_chat_llm, get_openai_client, register
+
+AI_MAX_CONCURRENCY = env_int("AI_MAX_CONCURRENCY", 8)     # 同時にモデルへ投げる件数
+AI_RATE_PER_MIN = env_int("AI_RATE_PER_MIN", 300)         # 1分あたりの呼び出し数
+AI_BURST = env_int("AI_BURST", 10)                        # 瞬間的に許す呼び出し数
+AI_DEADLINE_SEC = env_int("AI_DEADLINE_SEC", 60)          # 1回の呼び出しの締切（待ち時間込み）
+AI_MAX_RETRIES = env_int("AI_MAX_RETRIES", 4)
+AI_BACKOFF_BASE_MS = env_int("AI_BACKOFF_BASE_MS", 500)
+AI_BACKOFF_MAX_MS = env_int("AI_BACKOFF_MAX_MS", 8000)
+
+BUSY_MESSAGE = "AIが混み合っています。少し時間をおいてもう一度お試しください。"
+
+
+class AIGatewayError(Exception):
+    """画面表示用のメッセージを持つ例外"""
+
+
+# ==================================================
+# 🚦 トークンバケット＋同時実行数＋ユーザー別ラウンドロビン
+# ==================================================
+class FairRateLimiter:
+    def __init__(self, max_concurrency: int, rate_per_sec: float, burst: int):
+        self.max_concurrency = max_concurrency
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._active = 0
+        self._queues = OrderedDict()  # user_key -> deque[ticket]（先頭のユーザーが次の番）
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_sec)
+        self._refilled_at = now
+
+    def _is_next(self, user_key, ticket) -> bool:
+        first_user = next(iter(self._queues))
+        return first_user == user_key and self._queues[user_key][0] is ticket
+
+    def _dequeue(self, user_key, ticket):
+        queue = self._queues.get(user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[user_key]
+
+    def acquire(self, user_key: str, deadline: float):
+        """実行枠を1つ確保（deadline を過ぎたら AIGatewayError）"""
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(user_key, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (self._is_next(user_key, ticket)
+                            and self._active < self.max_concurrency
+                            and self._tokens >= 1):
+                        self._dequeue(user_key, ticket)
+                        # 🔁 まだ待っている分があれば列の最後に回す（ラウンドロビン）
+                        if user_key in self._queues:
+                            self._queues.move_to_end(user_key)
+                        self._active += 1
+                        self._tokens -= 1
+                        self._cond.notify_all()
+                        return
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise AIGatewayError(BUSY_MESSAGE)
+                    wait = remaining
+                    if self._tokens < 1:
+                        wait = min(wait, (1 - self._tokens) / self.rate_per_sec)
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._dequeue(user_key, ticket)
+                self._cond.notify_all()
+                raise
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+# ==================================================
+# 🔁 再試行の判定・待ち時間
+# ==================================================
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    ))
+
+
+def _retry_after_sec(error: Exception):
+    """サーバーが Retry-After を返していればその秒数"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def backoff_sec(attempt: int) -> float:
+    """フルジッター付き指数バックオフ（attempt=0,1,2,...）"""
+    cap = min(AI_BACKOFF_MAX_MS, AI_BACKOFF_BASE_MS * (2 ** attempt)) / 1000
+    return random.uniform(0, cap)
+
+
+def friendly_error(error: Exception) -> AIGatewayError:
+    """OpenAI の例外を画面に出せる文言に変換"""
+    import openai
+
+    if isinstance(error, AIGatewayError):
+        return error
+    if _is_retryable(error):
+        return AIGatewayError(BUSY_MESSAGE)
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return AIGatewayError("AIの認証に失敗しました。管理者に連絡してください。")
+    if isinstance(error, openai.BadRequestError):
+        return AIGatewayError("AIが処理できない入力でした。内容を見直してもう一度お試しください。")
+    return AIGatewayError(f"AIの呼び出しに失敗しました（{type(error).__name__}）")
+
+
+def current_user_key() -> str:
+    """公平制御の単位。ログイン中は会員番号、画面外（バックグラウンド処理）は system"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    import streamlit as st
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return "system"
+    return str(st.session_state.get("member_id") or ctx.session_id)
+
+
+# ==================================================
+# 🚪 ゲートウェイ本体
+# ==================================================
+class AIGateway:
+    def __init__(self):
+        self.limiter = FairRateLimiter(
+            max_concurrency=AI_MAX_CONCURRENCY,
+            rate_per_sec=AI_RATE_PER_MIN / 60,
+            burst=AI_BURST,
+        )
+
+    def _acquire(self, record, user_key: str, deadline: float):
+        """実行枠の確保（待ち時間を記録に足す）"""
+        waited_from = time.monotonic()
+        try:
+            self.limiter.acquire(user_key, deadline)
+        except AIGatewayError as e:
+            record.fail(e, "busy")
+            raise
+        finally:
+            record.queue_sec += time.monotonic() - waited_from
+        record.attempts += 1
+
+    def _give_up(self, record, error: Exception):
+        # 画面には言い換えた文言を出し、元の例外は ai_metrics（管理者の AI利用状況）に残す
+        record.fail(error, "busy" if _is_retryable(error) else "error")
+        raise friendly_error(error) from error
+
+    def run(self, feature: str, fn, user_key: str = None, deadline_sec: float = None, model: str = None):
+        """fn(timeout) を制限付きで実行して結果を返す
+
+        fn は残り秒数を timeout として受け取り、その時間内に終わるように API を呼ぶ。
+        所要時間・待ち時間・トークン数は ai_metrics に記録される。
+        """
+        user_key = user_key or current_user_key()
+        deadline = time.monotonic() + (deadline_sec or AI_DEADLINE_SEC)
+
+        with track(feature, model) as record:
+            for attempt in range(AI_MAX_RETRIES + 1):
+                self._acquire(record, user_key, deadline)
+                try:
+                    result = fn(max(deadline - time.monotonic(), 1))
+                    add_usage_from(getattr(result, "usage", None))
+                    return result
+                except Exception as e:
+                    error = e
+                finally:
+                    self.limiter.release()
+
+                wait = _retry_after_sec(error) or backoff_sec(attempt)
+                if not _is_retryable(error) or attempt == AI_MAX_RETRIES or time.monotonic() + wait >= deadline:
+                    self._give_up(record, error)
+                time.sleep(wait)
+
+    def stream(self, feature: str, fn, user_key: str = None, deadline_sec: float = None, model: str = None):
+        """fn(timeout) が返すストリームを、最後まで読み終えるまで枠を確保したまま yield
+
+        再試行は最初のチャンクが届くまで（途中まで表示した後にやり直すと文が重複するため）。
+        トークン数は fn 側で add_usage_from / current_record().add_usage により記録する。
+        """
+        user_key = user_key or current_user_key()
+        deadline = time.monotonic() + (deadline_sec or AI_DEADLINE_SEC)
+
+        with track(feature, model) as record:
+            for attempt in range(AI_MAX_RETRIES + 1):
+                self._acquire(record, user_key, deadline)
+                started = False
+                try:
+                    for chunk in fn(max(deadline - time.monotonic(), 1)):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    error = e
+                finally:
+                    self.limiter.release()
+
+                wait = _retry_after_sec(error) or backoff_sec(attempt)
+                if (started or not _is_retryable(error) or attempt == AI_MAX_RETRIES
+                        or time.monotonic() + wait >= deadline):
+                    self._give_up(record, error)
+                time.sleep(wait)
+
+
+register("ai_gateway", AIGateway)
+
+
+def get_gateway() -> AIGateway:
+    return get("ai_gateway")
+
+
+# ==================================================
+# 🧰 よく使う呼び出し
+# ==================================================
+def chat_completion(feature: str, user_key: str = None, deadline_sec: float = None, **kwargs):
+    """chat.completions.create（vision / JSON 出力も同じ）"""
+    return get_gateway().run(
+        feature,
+        lambda timeout: get_openai_client().with_options(timeout=timeout).chat.completions.create(**kwargs),
+        user_key=user_key,
+        deadline_sec=deadline_sec,
+        model=kwargs.get("model"),
+    )
+
+
+def stream_chat_text(feature: str, user_key: str = None, deadline_sec: float = None, **kwargs):
+    """chat.completions.create(stream=True) の本文テキストだけを順に yield"""
+    def _open(timeout):
+        stream = get_openai_client().with_options(timeout=timeout).chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},  # 最後のチャンクでトークン数を受け取る
+            **kwargs
+        )
+        for chunk in stream:
+            add_usage_from(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    return get_gateway().stream(
+        feature, _open, user_key=user_key, deadline_sec=deadline_sec, model=kwargs.get("model")
+    )
+
+
+def transcribe(feature: str, user_key: str = None, deadline_sec: float = None, **kwargs):
+    """audio.transcriptions.create（Whisper）"""
+    return get_gateway().run(
+        feature,
+        lambda timeout: get_openai_client().with_options(timeout=timeout).audio.transcriptions.create(**kwargs),
+        user_key=user_key,
+        deadline_sec=deadline_sec,
+        model=kwargs.get("model"),
+    )
+
+
+def stream_chain(feature: str, build_chain, inputs: dict, user_key: str = None, deadline_sec: float = None):
+    """LangChain の chain.stream()。build_chain(llm) に締切つきの LLM を渡して chain を組み立てる"""
+    llm = get_chat_llm()
+
+    def _open(timeout):
+        for chunk in build_chain(llm.bind(timeout=timeout)).stream(inputs):
+            usage = getattr(chunk, "usage_metadata", None)
+            if usage and current_record() is not None:
+                current_record().add_usage(
+                    usage.get("input_tokens", 0),
+                    usage.get("output_tokens", 0),
+                    (usage.get("input_token_details") or {}).get("cache_read", 0),
+                )
+            yield chunk
+
+    return get_gateway().stream(
+        feature, _open, user_key=user_key, deadline_sec=deadline_sec, model=getattr(llm, "model_name", None)
+    )
@@ -0,0 +1,197 @@
+# =============================================
+# ai_metrics.py（モデル呼び出しの所要時間・トークン数の記録）
+# =============================================
+# ai_gateway を通る呼び出し（＋Edge-TTS）ごとに1件のサンプルを記録する。
+#   feature / model / outcome / wall_ms（全体） / queue_ms（順番待ち） /
+#   prompt_tokens / cached_tokens（うちプロンプトキャッシュ分） / completion_tokens / attempts / at /
+#   error（失敗時のみ：元の例外の型とメッセージ）
+# サンプルはプロセス内のリングバッファに溜め、一定件数・一定時間ごとに
+# Firestore「ai_metrics」へ1文書（samples 配列）としてまとめて書き出す。
+# 集計（p50 / p95）は管理者メニューの「📈 AI利用状況」で行う。
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from services import env_int, get, get_db, register
+
+METRICS_COLLECTION = "ai_metrics"
+AI_METRICS_BUFFER = env_int("AI_METRICS_BUFFER", 2000)           # プロセス内に残す件数
+AI_METRICS_FLUSH_EVERY = env_int("AI_METRICS_FLUSH_EVERY", 50)   # この件数たまったら書き出す
+AI_METRICS_FLUSH_SEC = env_int("AI_METRICS_FLUSH_SEC", 60)       # または前回からこの秒数経ったら
+ERROR_MAX_CHARS = 300                                             # 1件に残すエラー文の長さ
+
+_local = threading.local()
+
+
+# ==================================================
+# 📝 1回の呼び出しの記録
+# ==================================================
+class CallRecord:
+    def __init__(self, feature: str, model: str = None):
+        self.feature = feature
+        self.model = model
+        self.outcome = "ok"
+        self.queue_sec = 0.0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.attempts = 0
+        self.error = None
+        self.at = datetime.now(timezone.utc)
+        self._started = time.monotonic()
+        self.wall_sec = None
+
+    def add_usage(self, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        self.prompt_tokens += prompt_tokens or 0
+        self.completion_tokens += completion_tokens or 0
+        self.cached_tokens += cached_tokens or 0
+
+    def fail(self, error: BaseException, outcome: str = "error"):
+        """失敗として記録（元の例外の型とメッセージを残す。最初に記録したものを優先）"""
+        self.outcome = outcome
+        if self.error is None:
+            self.error = f"{type(error).__name__}: {error}"[:ERROR_MAX_CHARS]
+
+    def to_dict(self) -> dict:
+        return {
+            "feature": self.feature,
+            "model": self.model,
+            "outcome": self.outcome,
+            "wall_ms": round(self.wall_sec * 1000),
+            "queue_ms": round(self.queue_sec * 1000),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "attempts": self.attempts,
+            "error": self.error,
+            "at": self.at,
+        }
+
+
+def current_record() -> CallRecord | None:
+    """いま計測中の呼び出し（usage を後から足すときに使う）"""
+    return getattr(_local, "record", None)
+
+
+def _cached_tokens(usage) -> int:
+    """usage.prompt_tokens_details.cached_tokens（SDK のバージョンにより dict のこともある）"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def add_usage_from(usage):
+    """OpenAI の usage（prompt_tokens / completion_tokens / キャッシュ分）を計測中の記録に足す"""
+    record = current_record()
+    if record is not None and usage is not None:
+        record.add_usage(
+            getattr(usage, "prompt_tokens", 0),
+            getattr(usage, "completion_tokens", 0),
+            _cached_tokens(usage),
+        )
+
+
+@contextmanager
+def track(feature: str, model: str = None):
+    """with track("correct_essay", "gpt-4o-mini") as rec: ... の区間を1サンプルとして記録
+
+    例外で抜けたら outcome="error" と error を記録（呼び出し側で rec.fail() を先に呼んでもよい）。
+    """
+    record = CallRecord(feature, model)
+    previous = current_record()
+    _local.record = record
+    try:
+        yield record
+    except BaseException as e:
+        record.fail(e, record.outcome if record.outcome != "ok" else "error")
+        raise
+    finally:
+        _local.record = previous
+        record.wall_sec = time.monotonic() - record._started
+        get_metrics_store().add(record.to_dict())
+
+
+# ==================================================
+# 🗃 リングバッファ＋Firestore への書き出し
+# ==================================================
+class MetricsStore:
+    def __init__(self):
+        self._recent = deque(maxlen=AI_METRICS_BUFFER)
+        self._pending = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, sample: dict):
+        with self._lock:
+            self._recent.append(sample)
+            self._pending.append(sample)
+            due = (len(self._pending) >= AI_METRICS_FLUSH_EVERY
+                   or time.monotonic() - self._flushed_at >= AI_METRICS_FLUSH_SEC)
+            batch = self._take_pending() if due else None
+        if batch:
+            # 書き込みは画面の応答を待たせないよう別スレッドで
+            threading.Thread(target=self._write, args=(batch,), daemon=True).start()
+
+    def _take_pending(self) -> list:
+        batch, self._pending = self._pending, []
+        self._flushed_at = time.monotonic()
+        return batch
+
+    def _write(self, batch: list):
+        try:
+            get_db().collection(METRICS_COLLECTION).add({
+                "flushed_at": datetime.now(timezone.utc),
+                "pid": os.getpid(),
+                "samples": batch,
+            })
+        except Exception as e:
+            print(f"⚠️ AIメトリクス書き出しエラー: {e}")
+
+    def flush(self):
+        """未書き出し分をすぐに書き出す（プロセス終了時など）"""
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._write(batch)
+
+    def recent(self) -> list:
+        """このプロセスの直近サンプル（書き出し済みも含む）"""
+        with self._lock:
+            return list(self._recent)
+
+    def pending(self) -> list:
+        """まだ Firestore に書き出していないサンプル"""
+        with self._lock:
+            return list(self._pending)
+
+
+register("ai_metrics", MetricsStore)
+
+
+def get_metrics_store() -> MetricsStore:
+    return get("ai_metrics")
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        get_metrics_store().flush()
+    except Exception:
+        pass
+
+
+def load_samples(hours: int = 24) -> list:
+    """直近 hours 時間のサンプル（Firestore の書き出し分＋このプロセスの未書き出し分）"""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    samples = []
+    docs = get_db().collection(METRICS_COLLECTION).where("flushed_at", ">=", since).stream()
+    for d in docs:
+        samples.extend(s for s in (d.to_dict() or {}).get("samples", []) if s.get("at") and s["at"] >= since)
+    samples.extend(s for s in get_metrics_store().pending() if s["at"] >= since)
+    return samples
@@ -0,0 +1,305 @@
+# =============================================
+# audio_pipeline.py（英会話の録音バッファ・Whisper 送信用エンコード）
+# =============================================
+# WebRTC のワーカースレッドに届く av.AudioFrame を、その場で 16 kHz・int16 モノラルに変換し、
+# あらかじめ確保した固定長のリングバッファへ書き込む。
+#   - 上限（AUDIO_MAX_SECONDS）を超えたら古い音から上書き：録音を止め忘れてもメモリは増えない
+#   - 書き込み（ワーカースレッド）と取り出し（スクリプトスレッド）はロックで排他
+#   - 同じ内容を前半・後半の2か所に書く「ミラー方式」なので、取り出しは常にコピーなしのスライス
+# 送信用のエンコード（WAV / Ogg Opus）もメモリ上で行い、一時ファイルは作らない。
+# UtteranceSegmenter は音量（RMS）で発話区間を判定し、前後の無音を落として
+# 「話し終わり」ごとに1件ずつ送信用データを待ち行列に積む。
+
+import io
+import os
+import queue
+import threading
+import time
+import wave
+from collections import deque
+from contextlib import contextmanager
+
+import av
+
+from services import env_int, lazy_import
+
+# 💤 numpy は録音を始めた時点で読み込む
+np = lazy_import("numpy")
+
+# Whisper は内部で 16 kHz モノラルに変換するので、48 kHz のまま送っても精度は変わらない
+CAPTURE_SAMPLE_RATE = 16000                            # バッファに溜めるサンプリングレート
+AUDIO_MAX_SECONDS = env_int("AUDIO_MAX_SECONDS", 60)   # 1回の発話として保持する最大秒数（超えたらそこで区切る）
+AUDIO_UPLOAD_FORMAT = os.getenv("AUDIO_UPLOAD_FORMAT", "wav").lower()  # wav / ogg（Opus 圧縮）
+OPUS_BITRATE = env_int("AUDIO_OPUS_BITRATE", 24000)
+
+# 🗣 発話区間の検出（VAD）
+VAD_WINDOW_MS = 30                                           # 判定の単位
+VAD_START_MS = env_int("VAD_START_MS", 90)                   # この長さ声が続いたら話し始め
+VAD_END_SILENCE_MS = env_int("VAD_END_SILENCE_MS", 700)      # この長さ無音が続いたら話し終わり
+VAD_MIN_SPEECH_MS = env_int("VAD_MIN_SPEECH_MS", 300)        # これより短い発話（咳・物音）は送らない
+VAD_PREROLL_MS = 300                                         # 話し始めの直前も少し残す（語頭の子音が切れないように）
+VAD_HANGOVER_MS = 200                                        # 話し終わりの後ろに残す無音
+VAD_MIN_RMS = env_int("VAD_MIN_RMS", 400)                    # 声とみなす最小の音量（int16 の RMS）
+VAD_NOISE_RATIO = 3.0                                        # 周囲の雑音の何倍で声とみなすか
+VAD_MAX_PENDING = 5                                          # 未送信の発話をためておく上限
+
+
+# ==================================================
+# 🔄 フレーム → int16 モノラル
+# ==================================================
+def new_mono_resampler(rate: int = CAPTURE_SAMPLE_RATE) -> av.AudioResampler:
+    """float / planar / ステレオのフレームも正しく int16 モノラルにする変換器（1ストリームに1つ）"""
+    return av.AudioResampler(format="s16", layout="mono", rate=rate)
+
+
+def frame_to_mono_int16(frame: av.AudioFrame, resampler: av.AudioResampler):
+    """1フレーム分の int16 モノラル PCM（変換器の内部バッファの都合で空のこともある）"""
+    chunks = [f.to_ndarray().reshape(-1) for f in resampler.resample(frame)]
+    if not chunks:
+        return np.zeros(0, dtype=np.int16)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+# ==================================================
+# 🔁 固定長リングバッファ（スレッドセーフ）
+# ==================================================
+class PCMRingBuffer:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity * 2, dtype=np.int16)  # [0, capacity) と [capacity, 2*capacity) は同じ内容
+        self._end = 0        # 次に書き込む位置（0 <= _end < capacity）
+        self._size = 0       # 保持しているサンプル数
+        self.dropped = 0     # 上限を超えて捨てた（上書きした）サンプル数
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._size
+
+    def write(self, samples):
+        """int16 モノラルのサンプル列を追記（溢れた分は古い方から捨てる）"""
+        n = len(samples)
+        if n == 0:
+            return
+        cap = self.capacity
+        with self._lock:
+            if n > cap:
+                self.dropped += n - cap
+                samples, n = samples[-cap:], cap
+            head = min(n, cap - self._end)   # 末尾までに収まる分
+            tail = n - head                  # 先頭に折り返す分
+            for base in (0, cap):
+                self._buf[base + self._end:base + self._end + head] = samples[:head]
+                self._buf[base:base + tail] = samples[head:]
+            self._end = (self._end + n) % cap
+            self.dropped += max(0, self._size + n - cap)
+            self._size = min(cap, self._size + n)
+
+    @contextmanager
+    def drain(self):
+        """with buffer.drain() as pcm: ... で古い順の全サンプルをコピーなしで読み、抜けたら空にする
+
+        読んでいる間は書き込みを止めるので、with の中では変換・エンコードだけを行うこと。
+        """
+        with self._lock:
+            start = (self._end - self._size) % self.capacity
+            try:
+                yield self._buf[start:start + self._size]
+            finally:
+                self._end = 0
+                self._size = 0
+                self.dropped = 0
+
+    def clear(self):
+        with self._lock:
+            self._end = 0
+            self._size = 0
+            self.dropped = 0
+
+
+# ==================================================
+# 🗣 発話区間の切り出し（エネルギー VAD）
+# ==================================================
+class UtteranceSegmenter:
+    """PCM を 30ms ごとに判定し、発話ごとの PCM を utterances に積む
+
+    feed() は WebRTC のワーカースレッド、finish() / take_utterances() はスクリプトスレッドから呼ばれる。
+    エンコードは時間がかかるので、ロックの外（take_utterances() を呼んだスクリプトスレッド）で行う。
+    """
+
+    def __init__(self, sample_rate: int = CAPTURE_SAMPLE_RATE, max_seconds: int = AUDIO_MAX_SECONDS):
+        self.sample_rate = sample_rate
+        self.window = sample_rate * VAD_WINDOW_MS // 1000
+        self.buffer = PCMRingBuffer(sample_rate * max_seconds)
+        self.utterances = queue.Queue(maxsize=VAD_MAX_PENDING)
+        self._start_windows = max(1, VAD_START_MS // VAD_WINDOW_MS)
+        self._end_windows = max(1, VAD_END_SILENCE_MS // VAD_WINDOW_MS)
+        self._min_speech_windows = VAD_MIN_SPEECH_MS // VAD_WINDOW_MS
+        self._hangover_windows = VAD_HANGOVER_MS // VAD_WINDOW_MS
+        self._preroll = deque(maxlen=VAD_PREROLL_MS // VAD_WINDOW_MS)
+        self._carry = np.zeros(0, dtype=np.int16)  # 30ms に満たない端数
+        self._silence = []        # 発話中の無音（発話が続けば書き戻し、終われば捨てる）
+        self._speaking = False
+        self._onset = 0           # 無音中に連続した「声」の窓数
+        self._speech_windows = 0  # この発話で声だった窓数
+        self._noise_rms = None    # 周囲の雑音レベル（無音中に追従）
+        self._muted_until = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- 入力 ----------
+    def feed(self, samples):
+        """int16 モノラルのサンプル列を受け取る"""
+        with self._lock:
+            if time.monotonic() < self._muted_until:
+                return
+            if len(self._carry):
+                samples = np.concatenate([self._carry, samples])
+            usable = len(samples) // self.window * self.window
+            for w in samples[:usable].reshape(-1, self.window):
+                self._process_window(w)
+            self._carry = samples[usable:].copy()
+
+    def mute(self, seconds: float):
+        """AI の音声を再生している間など、seconds 秒だけ入力を無視する（話しかけ中の発話は確定させる）"""
+        with self._lock:
+            if self._speaking:
+                self._end_utterance()
+            self._reset_state()
+            self._muted_until = time.monotonic() + seconds
+
+    def finish(self):
+        """話し終わりを待たずに今の発話を確定（送信ボタン・録音停止時）"""
+        with self._lock:
+            if self._speaking:
+                self._end_utterance()
+
+    def take_utterances(self) -> list[tuple[str, bytes, str]]:
+        """確定済みの発話をすべて取り出し、送信用にエンコードして [(ファイル名, バイト列, MIME)] で返す"""
+        items = []
+        while True:
+            try:
+                pcm = self.utterances.get_nowait()
+            except queue.Empty:
+                return items
+            items.append(encode_for_upload(pcm, self.sample_rate))
+
+    # ---------- 判定 ----------
+    def _is_speech(self, w) -> bool:
+        rms = float(np.sqrt(np.mean(w.astype(np.float32) ** 2)))
+        threshold = max(VAD_MIN_RMS, (self._noise_rms or 0) * VAD_NOISE_RATIO)
+        speech = rms >= threshold
+        if not speech and not self._speaking:
+            self._noise_rms = rms if self._noise_rms is None else 0.95 * self._noise_rms + 0.05 * rms
+        return speech
+
+    def _process_window(self, w):
+        speech = self._is_speech(w)
+
+        if not self._speaking:
+            self._preroll.append(w.copy())
+            self._onset = self._onset + 1 if speech else 0
+            if self._onset >= self._start_windows:
+                # 🎙 話し始め：直前の音から書き込む
+                self._speaking = True
+                self._speech_windows = self._onset
+                for p in self._preroll:
+                    self.buffer.write(p)
+                self._preroll.clear()
+            return
+
+        if speech:
+            # 文中の間（ま）は残す
+            for s in self._silence:
+                self.buffer.write(s)
+            self._silence.clear()
+            self.buffer.write(w)
+            self._speech_windows += 1
+            if len(self.buffer) >= self.buffer.capacity:
+                self._end_utterance()  # 長すぎる発話はここで区切る
+        else:
+            self._silence.append(w.copy())
+            if len(self._silence) >= self._end_windows:
+                self._end_utterance()
+
+    def _end_utterance(self):
+        """🔚 話し終わり：後ろの無音を落とし、PCM のコピーを積む（エンコードは take_utterances() で）"""
+        for s in self._silence[:self._hangover_windows]:
+            self.buffer.write(s)
+        long_enough = self._speech_windows >= self._min_speech_windows
+        with self.buffer.drain() as pcm:
+            utterance = pcm.copy() if long_enough and len(pcm) else None
+        self._reset_state()
+
+        if utterance is None:
+            return
+        try:
+            self.utterances.put_nowait(utterance)
+        except queue.Full:
+            print("⚠️ 未送信の発話が多すぎるため、この発話を破棄しました")
+
+    def _reset_state(self):
+        self._silence.clear()
+        self._preroll.clear()
+        self._speaking = False
+        self._onset = 0
+        self._speech_windows = 0
+        self.buffer.clear()
+
+
+# ==================================================
+# 💾 送信用エンコード（メモリ上）
+# ==================================================
+def pcm_to_wav_bytes(pcm, sample_rate: int = CAPTURE_SAMPLE_RATE) -> bytes:
+    """int16 モノラル PCM → WAV バイト列"""
+    if len(pcm) == 0:
+        raise ValueError("音声フレームが空です。")
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)  # ndarray のまま渡す（バッファのスライスを余計にコピーしない）
+    return buf.getvalue()
+
+
+def pcm_to_ogg_bytes(pcm, sample_rate: int = CAPTURE_SAMPLE_RATE) -> bytes:
+    """int16 モノラル PCM → Ogg Opus バイト列（WAV の 1/5 程度）"""
+    if len(pcm) == 0:
+        raise ValueError("音声フレームが空です。")
+
+    frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+    frame.sample_rate = sample_rate
+    buf = io.BytesIO()
+    with av.open(buf, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=sample_rate, layout="mono")
+        stream.bit_rate = OPUS_BITRATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buf.getvalue()
+
+
+def encode_for_upload(pcm, sample_rate: int = CAPTURE_SAMPLE_RATE) -> tuple[str, bytes, str]:
+    """AUDIO_UPLOAD_FORMAT に従ってエンコード → (ファイル名, バイト列, MIME)
+
+    Opus のエンコードに失敗した場合（ffmpeg に libopus がない等）は WAV で送る。
+    """
+    if len(pcm) == 0:
+        raise ValueError("音声フレームが空です。")
+    if AUDIO_UPLOAD_FORMAT == "ogg":
+        try:
+            return "speech.ogg", pcm_to_ogg_bytes(pcm, sample_rate), "audio/ogg"
+        except Exception as e:
+            print(f"⚠️ Opus エンコードエラー（WAV で送信）: {e}")
+    return "speech.wav", pcm_to_wav_bytes(pcm, sample_rate), "audio/wav"
+
+
+def audio_duration_sec(audio_bytes: bytes) -> float:
+    """音声データ（mp3 など）の長さ（秒）。判定できなければ 0"""
+    try:
+        with av.open(io.BytesIO(audio_bytes)) as container:
+            return (container.duration or 0) / av.time_base
+    except Exception:
+        return 0.0
@@ -0,0 +1,141 @@
+# =============================================
+# correction_cache.py（英作文添削結果のキャッシュ）
+# =============================================
+# 同じお題に同じ（ほぼ同じ）英文が提出されたら、gpt-4o-mini を呼ばずに前回の添削を返す。
+#   ① プロセス内メモリ（LRU）
+#   ② Firestore「correction_cache」コレクション（TTL 付き・全プロセス共有）
+# の順に探し、どちらにも無ければ呼び出し側で生成して put() する。
+#
+# ※ Firestore 側は expires_at フィールドに TTL ポリシーを設定しておくと期限切れ文書が自動削除される。
+
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from services import env_int, get, get_db, register
+
+CACHE_COLLECTION = "correction_cache"
+
+
+# ==================================================
+# 🔑 キー生成
+# ==================================================
+def normalize_text(text: str) -> str:
+    """全角/半角・改行・連続スペースの違いを吸収（大文字小文字は添削対象なので残す）"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def correction_cache_key(template: str, question: str, essay: str) -> str:
+    """（プロンプトテンプレート, お題, 英文）の正規化ハッシュ
+
+    テンプレート本文もキーに含めるため、プロンプトを書き換えると古いキャッシュは自然に使われなくなる。
+    """
+    parts = [template, normalize_text(question), normalize_text(essay)]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+# ==================================================
+# 🗃 キャッシュ本体
+# ==================================================
+class CorrectionCache:
+    """メモリ LRU + Firestore の2段キャッシュ（ヒット率つき）
+
+    - CORRECTION_CACHE_MAX_ENTRIES : メモリに保持する件数（既定 512）
+    - CORRECTION_CACHE_TTL_HOURS   : 有効期限（既定 168 = 7日）
+    """
+
+    def __init__(self, max_entries: int = None, ttl_hours: int = None):
+        self.max_entries = max_entries or env_int("CORRECTION_CACHE_MAX_ENTRIES", 512)
+        self.ttl = timedelta(hours=ttl_hours or env_int("CORRECTION_CACHE_TTL_HOURS", 168))
+        self._memory = OrderedDict()  # key -> (correction, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "store_hits": 0, "misses": 0, "evictions": 0}
+
+    # ---------- メモリ LRU ----------
+    def _remember(self, key: str, correction: str, expires_at: datetime):
+        with self._lock:
+            self._memory[key] = (correction, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _recall(self, key: str, now: datetime):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            correction, expires_at = entry
+            if expires_at <= now:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return correction
+
+    # ---------- 公開 API ----------
+    def get(self, key: str):
+        """キャッシュ済みの添削結果（無ければ None）"""
+        now = datetime.now(timezone.utc)
+
+        correction = self._recall(key, now)
+        if correction is not None:
+            self._count("memory_hits")
+            return correction
+
+        try:
+            snap = get_db().collection(CACHE_COLLECTION).document(key).get()
+        except Exception as e:
+            print(f"⚠️ 添削キャッシュ読込エラー: {e}")
+            snap = None
+
+        if snap is not None and snap.exists:
+            data = snap.to_dict() or {}
+            expires_at = data.get("expires_at")
+            if data.get("correction") and expires_at and expires_at > now:
+                self._remember(key, data["correction"], expires_at)
+                self._count("store_hits")
+                return data["correction"]
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, correction: str):
+        """添削結果を保存（成功した添削だけを渡すこと。成否は呼び出し側の StreamOutcome で判定）"""
+        if not correction:
+            return
+        now = datetime.now(timezone.utc)
+        expires_at = now + self.ttl
+        self._remember(key, correction, expires_at)
+        try:
+            get_db().collection(CACHE_COLLECTION).document(key).set({
+                "correction": correction,
+                "created_at": now,
+                "expires_at": expires_at,
+            })
+        except Exception as e:
+            print(f"⚠️ 添削キャッシュ保存エラー: {e}")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        """ヒット率などの統計（このプロセス分）"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["store_hits"] + stats["misses"]
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (stats["memory_hits"] + stats["store_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+register("correction_cache", CorrectionCache)
+
+
+def get_correction_cache() -> CorrectionCache:
+    """プロセス共有の添削キャッシュ"""
+    return get("correction_cache")
@@ -1,57 +1,36 @@
-import os
 import io
-import wave
 import asyncio
-import tempfile
-import numpy as np
 import av
-from datetime import datetime
 import streamlit as st
-from dotenv import load_dotenv
-from openai import OpenAI
 from streamlit_webrtc import webrtc_streamer, WebRtcMode, AudioProcessorBase
-import edge_tts
 
-from langchain.memory import ConversationBufferMemory
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+# ✅ モデル呼び出しは ai_gateway（流量制限・再試行つき）経由
+from services import env_int, lazy_import
+from ai_gateway import stream_chain, transcribe
+from ai_metrics import track
+from audio_pipeline import UtteranceSegmenter, audio_duration_sec, frame_to_mono_int16, new_mono_resampler
 
-# --- ✅ Pydanticエラー回避 ---
-ChatOpenAI.model_rebuild()
+# 💤 Edge-TTS は実際に使う時点で読み込む
+edge_tts = lazy_import("edge_tts")
 
-# --- 環境変数読み込み ---
-load_dotenv()
 
-# ✅ Secrets と .env の両対応
-OPENAI_API_KEY = None
-if "OPENAI_API_KEY" in st.secrets:
-    OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-elif os.getenv("OPENAI_API_KEY"):
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# --- ✅ LangChain Memory 安全初期化（セッションごと） ---
+def _get_memory():
+    from langchain.memory import ConversationBufferMemory
 
-if not OPENAI_API_KEY:
-    st.error("❌ OPENAI_API_KEY が設定されていません。Streamlit Cloud の Secrets または .env を確認してください。")
-    st.stop()
-
-# --- OpenAI 初期化 ---
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# --- ✅ LangChain Memory 安全初期化 ---
-if "conversation_memory" not in st.session_state or not isinstance(
-    st.session_state.get("conversation_memory"), ConversationBufferMemory
-):
-    st.session_state.conversation_memory = ConversationBufferMemory(return_messages=True)
-
-# --- LLM ---
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.6, api_key=OPENAI_API_KEY)
+    memory = st.session_state.get("conversation_memory")
+    if not isinstance(memory, ConversationBufferMemory):
+        memory = ConversationBufferMemory(return_messages=True)
+        st.session_state.conversation_memory = memory
+    return memory
 
 
 # --- AI応答生成 ---
-def get_ai_reply(user_text: str) -> str:
-    memory = st.session_state.get("conversation_memory")
-    if not memory:
-        st.session_state.conversation_memory = ConversationBufferMemory(return_messages=True)
-        memory = st.session_state.conversation_memory
+def stream_ai_reply(user_text: str):
+    """返答をトークンごとに yield。最後まで流れたら履歴に追加"""
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    memory = _get_memory()
 
     system_prompt = """
 あなたは優しい英会話講師です。
@@ -67,78 +46,78 @@ def get_ai_reply(user_text: str) -> str:
         ("human", "{input}"),
     ])
 
-    chain = prompt | llm
-    response = chain.invoke({
-        "input": user_text,
-        "history": memory.load_memory_variables({}).get("history", []),
-    })
+    parts = []
+    for chunk in stream_chain(
+        "get_ai_reply",
+        lambda llm: prompt | llm,
+        {
+            "input": user_text,
+            "history": memory.load_memory_variables({}).get("history", []),
+        },
+    ):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
 
-    reply = response.content
+    reply = "".join(parts)
     memory.chat_memory.add_user_message(user_text)
     memory.chat_memory.add_ai_message(reply)
-    return reply
 
 
 # --- Whisper文字起こし ---
-def transcribe_audio(wav_bytes: bytes) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        tmp.write(wav_bytes)
-        tmp.flush()
-        tmp_path = tmp.name
-
-    with open(tmp_path, "rb") as f:
-        result = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=f,
-            language="en",
-        )
+def transcribe_audio(audio_bytes: bytes, filename: str = "speech.wav") -> str:
+    # ファイルではなく (名前, バイト列) で渡す：一時ファイル不要で、再試行時も先頭から送り直せる
+    # （拡張子で形式が判定されるので filename は .wav / .ogg を合わせる）
+    result = transcribe(
+        "transcribe_audio",
+        model="whisper-1",
+        file=(filename, audio_bytes),
+        language="en",
+    )
     return result.text.strip()
 
 
 # --- Edge-TTS 音声合成 ---
-async def _edge_tts_to_file(text: str, voice: str, out_path: str):
-    tts = edge_tts.Communicate(text, voice=voice)
-    await tts.save(out_path)
+async def _edge_tts_to_bytes(text: str, voice: str) -> bytes:
+    buf = io.BytesIO()
+    async for chunk in edge_tts.Communicate(text, voice=voice).stream():
+        if chunk["type"] == "audio":
+            buf.write(chunk["data"])
+    return buf.getvalue()
 
-def synthesize_speech(text: str, voice="en-US-JennyNeural") -> str:
+def synthesize_speech(text: str, voice="en-US-JennyNeural") -> bytes:
+    """mp3 のバイト列（メモリ上で受け取り、一時ファイルは作らない）"""
     if not text.strip():
-        return ""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-        out_path = tmp.name
-    asyncio.run(_edge_tts_to_file(text, voice, out_path))
-    return out_path
+        return b""
+    # Edge-TTS は OpenAI ではないので ai_gateway を通さず、計測だけ行う
+    with track("synthesize_speech", voice):
+        return asyncio.run(_edge_tts_to_bytes(text, voice))
 
 
 # --- WebRTC 録音処理 ---
 class AudioProcessor(AudioProcessorBase):
-    def __init__(self):
-        self.frames = []
+    """届いた音声を 16 kHz モノラルにして発話区間を切り出す（WebRTC のワーカースレッドで実行）"""
 
-    def recv_audio(self, frame: av.AudioFrame) -> av.AudioFrame:
-        self.frames.append(frame)
-        return frame
+    def __init__(self):
+        self.segmenter = UtteranceSegmenter()
+        self._resampler = new_mono_resampler()
 
+    def _capture(self, frame: av.AudioFrame):
+        self.segmenter.feed(frame_to_mono_int16(frame, self._resampler))
 
-def frames_to_wav_bytes(frames) -> bytes:
-    if not frames:
-        raise ValueError("音声フレームが空です。")
+    def recv(self, frame: av.AudioFrame) -> av.AudioFrame:
+        self._capture(frame)
+        return frame
 
-    sample_rate = frames[0].sample_rate or 48000
-    pcm_list = []
-    for f in frames:
-        a = f.to_ndarray()
-        if a.ndim == 2:
-            a = a[0]
-        pcm_list.append(a)
-    pcm = np.concatenate(pcm_list).astype(np.int16)
+    async def recv_queued(self, frames: list[av.AudioFrame]) -> list[av.AudioFrame]:
+        # async_processing では recv() だと間のフレームが落ちるため、届いた分をすべて取り込む
+        for frame in frames:
+            self._capture(frame)
+        return frames
 
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(sample_rate)
-        wf.writeframes(pcm.tobytes())
-    return buf.getvalue()
+    def on_ended(self):
+        # Stop で話している途中の発話も送る
+        self.segmenter.finish()
 
 
 def extract_english_part(reply: str) -> str:
@@ -147,10 +126,131 @@ def extract_english_part(reply: str) -> str:
     return reply.split("\n")[0].strip()
 
 
+# --- 1発話ぶんの会話 ---
+CONVERSATION_POLL_SEC = 1.0   # 話し終わった発話があるか確認する間隔
+# 再生時間に足す余裕（合成が終わってから画面に届いて鳴り始めるまでの遅れ）
+CONVERSATION_MUTE_MARGIN_SEC = env_int("CONVERSATION_MUTE_MARGIN_MS", 1500) / 1000
+
+
+def _turn_slots() -> dict:
+    """1発話ぶんの表示枠。返答直後も再表示も同じ並び・同じ引数で描くことで、
+    定期実行のたびに音声プレーヤーが作り直されて再生が途切れないようにする"""
+    return {"user": st.empty(), "reply": st.empty(), "speech": st.empty(), "error": st.empty()}
+
+
+def _show_user_text(slots: dict, user_text: str):
+    slots["user"].markdown(f"**🗣 あなた:** {user_text}")
+
+
+def _show_reply(slots: dict, reply: str):
+    slots["reply"].markdown(f"**🤖 AIの返答:**\n\n{reply}")
+
+
+def _show_speech(slots: dict, speech: bytes):
+    slots["speech"].audio(speech, format="audio/mp3", autoplay=True)
+
+
+def _reply_to_utterance(upload: tuple[str, bytes, str], voice: str, slots: dict) -> dict:
+    """Whisper → ChatGPT（ストリーミング表示）→ Edge-TTS。次回以降の再表示用に結果を返す"""
+    filename, audio_bytes, _mime = upload
+    turn = {"user_text": "", "reply": "", "speech": b"", "error": ""}
+
+    with slots["user"].container(), st.spinner("🎧 Whisperで音声を解析中..."):
+        try:
+            turn["user_text"] = transcribe_audio(audio_bytes, filename)
+        except Exception as e:
+            turn["error"] = f"音声認識失敗: {e}"
+    if not turn["user_text"] and not turn["error"]:
+        turn["error"] = "⚠️ 音声が認識できませんでした。もう一度話してください。"
+    if turn["error"]:
+        _show_turn(turn, slots)
+        return turn
+
+    _show_user_text(slots, turn["user_text"])
+
+    # ⚡ 届いたトークンから順に表示（待ち時間＝最初の1文字までの時間）
+    try:
+        for chunk in stream_ai_reply(turn["user_text"]):
+            turn["reply"] += chunk
+            _show_reply(slots, turn["reply"])
+    except Exception as e:
+        turn["error"] = f"AI応答エラー: {e}"
+        _show_turn(turn, slots)
+        return turn
+
+    english_part = extract_english_part(turn["reply"])
+    if english_part:
+        with slots["speech"].container(), st.spinner("🔊 音声生成中..."):
+            turn["speech"] = synthesize_speech(english_part, voice=voice)
+    _show_turn(turn, slots)
+    return turn
+
+
+def _show_turn(turn: dict, slots: dict):
+    """直前の会話を表示枠に描く（定期実行で画面が消えないように）"""
+    if turn["user_text"]:
+        _show_user_text(slots, turn["user_text"])
+    else:
+        slots["user"].empty()
+    if turn["reply"]:
+        _show_reply(slots, turn["reply"])
+    else:
+        slots["reply"].empty()
+    if turn["speech"]:
+        _show_speech(slots, turn["speech"])
+    else:
+        slots["speech"].empty()
+    if turn["error"]:
+        slots["error"].warning(turn["error"])
+    else:
+        slots["error"].empty()
+
+
+def _show_history():
+    st.markdown("---")
+    st.subheader("💬 会話履歴（今回のセッション）")
+
+    try:
+        memory = st.session_state.get("conversation_memory")
+        if memory:
+            history = memory.load_memory_variables({}).get("history", [])
+        else:
+            history = []
+    except Exception as e:
+        st.error(f"⚠️ メモリ読み込みエラー: {e}")
+        history = []
+
+    if history:
+        for m in history:
+            role = "👤 You" if getattr(m, "type", "") == "human" else "🤖 AI"
+            st.markdown(f"**{role}:** {m.content}")
+    else:
+        st.caption("まだ会話履歴がありません。Start を押して英語で話しかけてみましょう。")
+
+
+@st.fragment(run_every=CONVERSATION_POLL_SEC)
+def _conversation_turns(voice: str):
+    """話し終わった発話を拾って返答する（WebRTC 部品は再実行せず、この部分だけ定期的に動かす）"""
+    processor = st.session_state.get("conversation_processor")
+    uploads = processor.segmenter.take_utterances() if processor else []
+    slots = _turn_slots()
+
+    if uploads:
+        for upload in uploads:
+            turn = _reply_to_utterance(upload, voice, slots)
+            if turn["speech"]:
+                # 🔇 AI の声をマイクが拾って次の発話にならないよう、再生中は入力を止める
+                processor.segmenter.mute(audio_duration_sec(turn["speech"]) + CONVERSATION_MUTE_MARGIN_SEC)
+        st.session_state["conversation_last_turn"] = turn
+    elif st.session_state.get("conversation_last_turn"):
+        _show_turn(st.session_state["conversation_last_turn"], slots)
+
+    _show_history()
+
+
 # --- メインUI ---
 def show_english_conversation():
     st.title("🎧 英会話")
-    # st.caption("🎙️ Start → Stop → この録音でAIに送信")
 
     col1, col2 = st.columns(2)
     with col1:
@@ -160,7 +260,7 @@ def show_english_conversation():
             index=0,
         )
     with col2:
-        st.caption("WebRTC録音 → Whisper認識 → ChatGPT応答 → Edge-TTS再生")
+        st.caption("WebRTC録音 → 発話検出 → Whisper認識 → ChatGPT応答 → Edge-TTS再生")
 
     st.markdown("---")
 
@@ -180,68 +280,15 @@ def show_english_conversation():
         audio_processor_factory=AudioProcessor,
     )
 
+    # Stop 後も最後の発話を取り出せるよう、プロセッサはセッションに残しておく
+    if ctx.audio_processor:
+        st.session_state["conversation_processor"] = ctx.audio_processor
+
     if not ctx.state.playing:
-        st.info("🎙️ Startボタンで録音開始 → Stopボタンで終了してください。")
+        st.info("🎙️ Startボタンで開始して、英語で話しかけてください。話し終わると自動でAIに送信します。")
     else:
-        st.success("🔴 録音中です。Stopを押して終了。")
-
-    if ctx.audio_processor and st.button("🎯 この録音でAIに送信"):
-        frames = ctx.audio_processor.frames
-        ctx.audio_processor.frames = []
-
-        if not frames:
-            st.warning("⚠️ 音声が取得できませんでした。録音が短すぎた可能性があります。")
-            return
-
-        try:
-            wav_bytes = frames_to_wav_bytes(frames)
-        except Exception as e:
-            st.error(f"音声処理エラー: {e}")
-            return
-
-        st.audio(wav_bytes, format="audio/wav")
+        st.success("🔴 聞き取り中です。話し終わって少し間をあけると自動で送信します。")
+        if ctx.audio_processor and st.button("🎯 いまの発話をすぐに送信"):
+            ctx.audio_processor.segmenter.finish()
 
-        with st.spinner("🎧 Whisperで音声を解析中..."):
-            try:
-                user_text = transcribe_audio(wav_bytes)
-            except Exception as e:
-                st.error(f"音声認識失敗: {e}")
-                return
-
-        if not user_text:
-            st.warning("⚠️ 音声が認識できませんでした。もう一度話してください。")
-            return
-
-        st.markdown(f"**🗣 あなた:** {user_text}")
-
-        with st.spinner("🤖 ChatGPTが応答中..."):
-            reply = get_ai_reply(user_text)
-        st.markdown("**🤖 AIの返答:**")
-        st.markdown(reply)
-
-        english_part = extract_english_part(reply)
-        if english_part:
-            with st.spinner("🔊 音声生成中..."):
-                audio_path = synthesize_speech(english_part, voice=voice)
-                if audio_path:
-                    st.audio(audio_path, format="audio/mp3")
-
-    st.markdown("---")
-    st.subheader("💬 会話履歴（今回のセッション）")
-
-    try:
-        memory = st.session_state.get("conversation_memory")
-        if memory:
-            history = memory.load_memory_variables({}).get("history", [])
-        else:
-            history = []
-    except Exception as e:
-        st.error(f"⚠️ メモリ読み込みエラー: {e}")
-        history = []
-
-    if history:
-        for m in history:
-            role = "👤 You" if getattr(m, "type", "") == "human" else "🤖 AI"
-            st.markdown(f"**{role}:** {m.content}")
-    else:
-        st.caption("まだ会話履歴がありません。Start → Stop → 送信で会話を始めてみましょう。")
+    _conversation_turns(voice)
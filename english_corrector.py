@@ -3,183 +3,429 @@
 # =============================================
 
 import streamlit as st
-from openai import OpenAI
-from dotenv import load_dotenv
-import os, random, base64
-import firebase_admin
-from firebase_admin import credentials, firestore
+import json
 from datetime import datetime
 
-# --- OpenAI 初期化 ---
-load_dotenv()
+# ✅ Firestore は共有レジストリ、モデル呼び出しは ai_gateway（流量制限・再試行つき）経由
+# ⚠️ services は gRPC の fork 設定を行うため firebase_admin.firestore より先に import する
+from services import get_db
+from firebase_admin import firestore
+from ai_gateway import chat_completion, stream_chat_text
+from correction_cache import correction_cache_key, get_correction_cache
+from question_pool import MODE_KEYS, pick_question, question_hash
+from near_duplicate import find_near_duplicate
+# 📷 OCR は ocr_service に集約（extract_text_from_image_bytes も従来どおりここから import 可）
+from ocr_service import encode_image_for_ocr, extract_text_from_image_bytes, get_cached_ocr, ocr_image, remember_ocr
 
-# ① Streamlit Secrets → ② .env の順で探索
-api_key = None
-if "OPENAI_API_KEY" in st.secrets:
-    api_key = st.secrets["OPENAI_API_KEY"]
-elif os.getenv("OPENAI_API_KEY"):
-    api_key = os.getenv("OPENAI_API_KEY")
 
-if not api_key:
-    st.error("❌ OPENAI_API_KEY が設定されていません。Streamlit Secrets または .env を確認してください。")
-    st.stop()
+# ==================================================
+# 🔹 ChatGPT ストリーミング呼び出し（共通）
+# ==================================================
+class StreamOutcome:
+    """ストリームの成否（st.write_stream の戻り値は表示した文字列だけなので、失敗はこちらで判定する）
 
-client = OpenAI(api_key=api_key)
+    途中まで流れてから失敗することもあるため、文字列の先頭（❌）では判定しない。
+    """
 
-# --- Firebase 初期化 ---
-if not firebase_admin._apps:
-    firebase_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
-    if not firebase_path or not os.path.exists(firebase_path):
-        st.error("❌ Firebase認証ファイルが見つかりません。")
-        st.stop()
-    cred = credentials.Certificate(firebase_path)
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
+    def __init__(self):
+        self.error = None
 
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
-# ==================================================
-# 🔹 ChatGPT 出題生成
-# ==================================================
-def generate_question(level: int, recent_questions: list[str], mode_type: str) -> str:
+
+def _chat_stream(feature: str, messages: list, temperature: float, error_label: str, outcome: StreamOutcome = None):
+    """応答テキストを届いた順に yield（失敗時はエラーメッセージを1つ yield し、outcome.error に記録）"""
     try:
-        seed = random.randint(1, 10000)
-        if mode_type == "和文英訳":
-            prompt = f"""
-            あなたは英作文問題の作成者です。
-            難易度レベル{level}の「和文英訳問題」を1問作ってください。
-            レベル1は中学英語基礎、レベル10は東大二次試験レベルです。
-            以下の出題（直近50問）とは絶対に重複しないようにしてください。
-            除外リスト: {recent_questions}
-            出力は日本文のみ1つだけ表示してください。
-            （乱数シード: {seed}）
-            """
-        else:
-            prompt = f"""
-            あなたは英作文のテーマ作成者です。
-            難易度レベル{level}の「自由英作文テーマ」を1問作ってください。
-            レベル1は簡単な日常会話、レベル10は抽象的・社会的テーマにしてください。
-            以下のテーマ（直近50件）とは重複しないようにしてください。
-            除外リスト: {recent_questions}
-            出力は「英作文テーマを日本語で1行のみ」。
-            （乱数シード: {seed}）
-            """
-        response = client.chat.completions.create(
+        yield from stream_chat_text(
+            feature,
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=1.0
+            messages=messages,
+            temperature=temperature
         )
-        return response.choices[0].message.content.strip()
     except Exception as e:
-        return f"❌ 出題エラー: {e}"
+        message = f"❌ {error_label}: {e}"
+        if outcome is not None:
+            outcome.error = message
+        yield message
+
+
+# ==================================================
+# 🔹 ChatGPT 出題生成
+# ==================================================
+# 近似重複（言い換え）だった場合に作り直す回数
+MAX_QUESTION_RETRIES = 3
+
+
+# 指示（変わらない部分）は system に置き、レベルなど変わる部分は最後の user に回す。
+# 先頭が毎回同じになるので、プロバイダ側のプロンプトキャッシュが効く。
+# （出題のばらつきは temperature で出す。乱数シードを混ぜると先頭が一致しなくなる）
+QUESTION_SYSTEM_PROMPTS = {
+    "和文英訳": """あなたは英作文問題の作成者です。
+指定された難易度レベルの「和文英訳問題」を1問作ってください。
+レベル1は中学英語基礎、レベル10は東大二次試験レベルです。
+出力は日本文のみ1つだけ表示してください。""",
+    "自由英作": """あなたは英作文のテーマ作成者です。
+指定された難易度レベルの「自由英作文テーマ」を1問作ってください。
+レベル1は簡単な日常会話、レベル10は抽象的・社会的テーマにしてください。
+出力は「英作文テーマを日本語で1行のみ」。""",
+}
+
+
+def _question_messages(level: int, mode_type: str) -> list:
+    system = QUESTION_SYSTEM_PROMPTS.get(mode_type, QUESTION_SYSTEM_PROMPTS["自由英作"])
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"難易度レベル{level}"}
+    ]
+
+
+def stream_question(level: int, mode_type: str, outcome: StreamOutcome = None):
+    """出題文をトークンごとに yield（st.write_stream 用。失敗は outcome で判定）
+
+    過去問との重複はプロンプトで指示せず、呼び出し側で find_near_duplicate により判定する。
+    """
+    return _chat_stream(
+        "generate_question", _question_messages(level, mode_type),
+        temperature=1.0, error_label="出題エラー", outcome=outcome
+    )
 
 
 # ==================================================
 # 🔹 添削プロンプト
 # ==================================================
+# 先頭は形式の指示（毎回同じ）、お題・英文は最後に置く（プロンプトキャッシュのため）
 PROMPT_FREE = """あなたは英語の専門講師です。
-次の英文を添削し、以下の3点を日本語で出力してください：
+ユーザーの英文を添削し、以下の3点を日本語で出力してください：
 ① 文法・語彙の誤りの指摘
 ② より自然な英文への改善提案
 ③ 模範解答例（自然で正確な英語）
+
 英文：
 {sentence}
 """
 
 PROMPT_EXAM = """あなたは英語の専門講師です。
-以下の日本文を英語に翻訳する問題を出題し、
-その後、ユーザーが入力した英文を添削します。
+【出題】の日本文を英語に翻訳する問題について、ユーザーが入力した英文を添削します。
+
+出力は次の形式で：
+① 文法・語彙の誤りの指摘
+② 改善された英文
+③ 模範解答例
 
 【出題】：
 {japanese_prompt}
 
 ユーザーの英文：
 {user_essay}
+"""
+
+PROMPT_THEME = """あなたは英語の専門講師です。
+【テーマ】に対する自由英作文を添削してください。
 
 出力は次の形式で：
 ① 文法・語彙の誤りの指摘
 ② 改善された英文
 ③ 模範解答例
-"""
-
-PROMPT_THEME = """あなたは英語の専門講師です。
-以下のテーマに対する自由英作文を添削してください。
 
 【テーマ】：
 {theme_prompt}
 
 ユーザーの英文：
 {user_essay}
-
-出力は次の形式で：
-① 文法・語彙の誤りの指摘
-② 改善された英文
-③ 模範解答例
 """
 
 
+def template_for_mode(mode_type: str) -> str:
+    """出題タイプ → 添削テンプレート（和文英訳 / 自由英作 以外は自由添削）"""
+    return {"和文英訳": PROMPT_EXAM, "自由英作": PROMPT_THEME}.get(mode_type, PROMPT_FREE)
+
+
+def build_correction_prompt(template: str, question: str, essay: str) -> str:
+    """どのテンプレートでも同じ引数で埋められるようにする"""
+    return template.format(japanese_prompt=question, theme_prompt=question, user_essay=essay, sentence=essay)
+
+
 # ==================================================
 # 🔹 ChatGPT 呼び出し
 # ==================================================
-def correct_essay(prompt_text: str) -> str:
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "あなたは日本人高校生の英作文を添削する英語講師です。"},
-                {"role": "user", "content": prompt_text}
-            ],
-            temperature=0.5
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"❌ 添削エラー: {e}"
+CORRECTION_SYSTEM_PROMPT = "あなたは日本人高校生の英作文を添削する英語講師です。"
+
+
+def stream_correction(prompt_text: str, cache_key: str = None, outcome: StreamOutcome = None):
+    """添削結果をトークンごとに yield（st.write_stream 用。失敗は outcome で判定）
+
+    cache_key を渡すと、キャッシュ済みなら一括で返し、未キャッシュなら最後まで成功した時だけ保存する。
+    """
+    outcome = outcome if outcome is not None else StreamOutcome()
+    cache = get_correction_cache() if cache_key else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for text in _chat_stream(
+        "correct_essay",
+        [
+            {"role": "system", "content": CORRECTION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt_text}
+        ],
+        temperature=0.5,
+        error_label="添削エラー",
+        outcome=outcome
+    ):
+        parts.append(text)
+        yield text
+
+    # 途中で失敗した添削（途中までの本文＋エラー行）は保存しない
+    if cache and outcome.ok:
+        cache.put(cache_key, "".join(parts).strip())
+
+
+def correct_essay(prompt_text: str, cache_key: str = None) -> str:
+    """添削を実行（cache_key を渡すと同じ答案には前回の結果を返す。失敗時は例外）"""
+    outcome = StreamOutcome()
+    result = "".join(stream_correction(prompt_text, cache_key, outcome)).strip()
+    if not outcome.ok:
+        raise RuntimeError(outcome.error)
+    return result
+
+
+# ==================================================
+# 🔹 撮影答案の読み取り＋添削（1回の呼び出し）
+# ==================================================
+IMAGE_ESSAY_PLACEHOLDER = "（添付画像に手書きされた英文）"
+
+# 読み取り＋添削の指示も system 側（固定の先頭）に置く
+ONE_SHOT_INSTRUCTIONS = """
+ユーザーの英文は添付画像に手書きされています。
+まず添付画像に書かれている英文を一字一句そのまま書き起こし（綴りや文法の誤りも直さない）、
+その英文をユーザーの指示する形式で添削してください。
+出力は次の2つのキーを持つ JSON オブジェクトのみ：
+{"transcription": "書き起こした英文", "correction": "添削結果（指示された形式・日本語）"}
+"""
+
+
+def correct_essay_from_image(image_bytes: bytes, template: str, question: str = "") -> tuple[str, str]:
+    """画像を添付して読み取りと添削を1回で行う → (書き起こし, 添削結果)。失敗時は例外
+
+    書き起こしは OCR キャッシュに、添削は添削キャッシュにも入れるので、
+    同じ写真・同じ英文の再提出では再度モデルを呼ばない。
+    """
+    prompt_text = build_correction_prompt(template, question, IMAGE_ESSAY_PLACEHOLDER)
+    response = chat_completion(
+        "ocr_and_correct",
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": CORRECTION_SYSTEM_PROMPT + ONE_SHOT_INSTRUCTIONS},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt_text},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image_for_ocr(image_bytes)}"}}
+                ]
+            }
+        ],
+        temperature=0.5,
+        response_format={"type": "json_object"}
+    )
+    data = json.loads(response.choices[0].message.content)
+    transcription = str(data.get("transcription", "")).strip()
+    correction = str(data.get("correction", "")).strip()
+
+    if not correction:
+        raise ValueError("添削結果が空でした")
+
+    if transcription:
+        remember_ocr(image_bytes, transcription)
+        get_correction_cache().put(correction_cache_key(template, question, transcription), correction)
+    return transcription, correction
 
 
 # ==================================================
 # 🔹 Firestore 履歴管理
 # ==================================================
-def get_recent_questions(user_id: str, level: int, mode_type: str, limit: int = 50) -> list[str]:
-    try:
-        docs = (
-            db.collection("users")
-            .document(user_id)
-            .collection("essay_history")
-            .where("level", "==", level)
-            .where("mode", "==", mode_type)
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .limit(limit)
-            .stream()
-        )
-        return [d.to_dict().get("question", "") for d in docs]
-    except Exception:
-        return []
+def _query_recent_questions(user_id: str, level: int, mode_type: str, limit: int) -> list[str]:
+    """essay_history から直近の出題文（読み込みエラーはそのまま送出）"""
+    docs = (
+        get_db().collection("users")
+        .document(user_id)
+        .collection("essay_history")
+        .where("level", "==", level)
+        .where("mode", "==", mode_type)
+        .order_by("timestamp", direction=firestore.Query.DESCENDING)
+        .limit(limit)
+        .stream()
+    )
+    return [d.to_dict().get("question", "") for d in docs]
+
+
+def _history_ref(user_id: str):
+    return get_db().collection("users").document(user_id).collection("essay_history")
 
 
 def save_history(user_id: str, data: dict):
-    db.collection("users").document(user_id).collection("essay_history").add(data)
+    _history_ref(user_id).add(data)
+
+
+# ==================================================
+# 🔹 1回の挑戦＝1文書（出題で作成 → 添削で更新）
+# ==================================================
+# essay_history/{attempt_id}
+#   mode, level, question, status("issued" → "corrected"), timestamp（出題時刻）,
+#   user_input, correction, corrected_at, revisions（添削し直した回数）
+HISTORY_PAGE_SIZE = 10
+
+
+def start_attempt(user_id: str, level: int, mode_type: str, question: str) -> str:
+    """出題時に挑戦文書を作成して ID を返す"""
+    ref = _history_ref(user_id).document()
+    ref.set({
+        "level": level,
+        "mode": mode_type,
+        "question": question,
+        "status": "issued",
+        "timestamp": datetime.now()
+    })
+    return ref.id
+
+
+def finish_attempt(user_id: str, attempt_id: str, essay_text: str, correction: str):
+    """添削結果を同じ挑戦文書に書き込む（同じお題で添削し直したら上書き）"""
+    _history_ref(user_id).document(attempt_id).update({
+        "user_input": essay_text,
+        "correction": correction,
+        "status": "corrected",
+        "corrected_at": datetime.now(),
+        "revisions": firestore.Increment(1)
+    })
+
+
+def fetch_history_page(user_id: str, page_size: int = HISTORY_PAGE_SIZE, start_after=None):
+    """新しい順に page_size 件 → (挑戦のリスト, 次ページ用カーソル or None)"""
+    query = _history_ref(user_id).order_by("timestamp", direction=firestore.Query.DESCENDING)
+    if start_after is not None:
+        query = query.start_after(start_after)
+    # 1件多く読んで次ページの有無を判定
+    snaps = list(query.limit(page_size + 1).stream())
+    has_next = len(snaps) > page_size
+    snaps = snaps[:page_size]
+    attempts = [{"id": d.id, **(d.to_dict() or {})} for d in snaps]
+    return attempts, (snaps[-1] if has_next else None)
+
+
+# ==================================================
+# 🔹 出題済みインデックス（1ユーザー1文書）
+# ==================================================
+# users/{id}/essay_meta/seen_questions
+#   exam_L3: [{"h": 問題文ハッシュ, "q": 問題文}, ...]  ← 古い順・最大 SEEN_LIMIT 件
+SEEN_LIMIT = 50
+
+
+def _seen_ref(user_id: str):
+    return get_db().collection("users").document(user_id).collection("essay_meta").document("seen_questions")
+
+
+def _seen_key(level: int, mode_type: str) -> str:
+    return f"{MODE_KEYS[mode_type]}_L{int(level)}"
+
+
+def get_seen_questions(user_id: str, level: int, mode_type: str) -> list[dict] | None:
+    """出題済みの問題を1 read で取得（インデックスが無い利用者は essay_history から作成）
+
+    インデックス文書の読み込みに失敗したときだけ None（この出題では既出チェックをせず、書き込みもしない）。
+    """
+    key = _seen_key(level, mode_type)
+    try:
+        snap = _seen_ref(user_id).get()
+    except Exception as e:
+        print(f"⚠️ 出題済みインデックス読込エラー: {e}")
+        return None
+
+    data = (snap.to_dict() or {}) if snap.exists else {}
+    if key in data:
+        return data[key]
+
+    # 🔁 旧形式からの移行（文書またはこの level×mode のキーが確かに無いときだけ・1回だけ）
+    # 旧履歴が読めない（複合インデックス未作成など）ときは空で作り、以降の出題から記録を始める
+    try:
+        legacy = _query_recent_questions(user_id, level, mode_type, SEEN_LIMIT)
+    except Exception as e:
+        print(f"⚠️ 出題済みインデックス移行エラー（空の一覧から記録を始めます）: {e}")
+        legacy = []
+    entries, known = [], set()
+    for q in reversed(legacy):
+        h = question_hash(q)
+        if q and h not in known:
+            known.add(h)
+            entries.append({"h": h, "q": q})
+    try:
+        _seen_ref(user_id).set({key: entries}, merge=True)
+    except Exception as e:
+        print(f"⚠️ 出題済みインデックス作成エラー: {e}")
+    return entries
+
+
+def record_seen_question(user_id: str, level: int, mode_type: str, question: str, seen: list[dict] | None):
+    """出題した問題をインデックスに追加（seen は get_seen_questions の結果。追加の read はしない）
+
+    seen が None（読めなかった）のときは、保存済みの一覧を一部だけで上書きしないよう何もしない。
+    """
+    if seen is None:
+        return
+    h = question_hash(question)
+    entries = [e for e in seen if e.get("h") != h] + [{"h": h, "q": question}]
+    _seen_ref(user_id).set({_seen_key(level, mode_type): entries[-SEEN_LIMIT:]}, merge=True)
 
 
 # ==================================================
-# 🔹 ChatGPT Vision OCR
+# 📚 履歴ビューア（ページ送り：1ページ HISTORY_PAGE_SIZE 件だけ読む）
 # ==================================================
-def extract_text_from_image_bytes(image_bytes_b64: str) -> str:
+def show_essay_history(user_id: str):
+    st.subheader("📚 これまでの履歴")
+
+    cursors = st.session_state.setdefault("essay_history_cursors", [None])
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "この画像に書かれている英語の文を正確に読み取り、テキストとして出力してください。"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_bytes_b64}"}}
-                    ]
-                }
-            ],
-            temperature=0
-        )
-        return response.choices[0].message.content.strip()
+        attempts, next_cursor = fetch_history_page(user_id, start_after=cursors[-1])
     except Exception as e:
-        return f"❌ 画像読取エラー: {e}"
+        st.error(f"❌ 履歴の読み込みに失敗しました: {e}")
+        return
+
+    if not attempts and len(cursors) == 1:
+        st.info("まだ履歴がありません。")
+        return
+
+    for a in attempts:
+        ts = a.get("timestamp")
+        when = ts.strftime("%Y/%m/%d %H:%M") if hasattr(ts, "strftime") else ""
+        level = f"・レベル{a['level']}" if a.get("level") else ""
+        title = (a.get("question") or a.get("user_input") or "")[:40]
+        pending = "" if a.get("correction") else "（未提出）"
+        with st.expander(f"{when}　{a.get('mode', '')}{level}　{title}{pending}"):
+            if a.get("question"):
+                st.markdown(f"**お題：** {a['question']}")
+            if a.get("user_input"):
+                st.markdown(f"**あなたの英文：** {a['user_input']}")
+            if a.get("correction"):
+                st.markdown("**添削結果：**")
+                st.write(a["correction"])
+
+    c1, c2, c3 = st.columns([1, 2, 1])
+    with c1:
+        if st.button("◀ 新しい方へ", key="history_prev", disabled=len(cursors) <= 1, use_container_width=True):
+            if len(cursors) > 1:
+                cursors.pop()
+            st.rerun()
+    with c2:
+        st.caption(f"{len(cursors)} ページ目")
+    with c3:
+        if st.button("古い方へ ▶", key="history_next", disabled=next_cursor is None, use_container_width=True):
+            if next_cursor is not None:
+                cursors.append(next_cursor)
+            st.rerun()
 
 
 # ==================================================
@@ -190,10 +436,14 @@ def show_essay_corrector(user_id: str):
 
     mode = st.radio(
         "モードを選択",
-        ["出題モード（和文英訳／自由英作）", "自由添削モード"],
+        ["出題モード（和文英訳／自由英作）", "自由添削モード", "📚 これまでの履歴"],
         horizontal=True
     )
 
+    if mode == "📚 これまでの履歴":
+        show_essay_history(user_id)
+        return
+
     # ✅ 外部camera.htmlリンクは削除（内部カメラのみ使用）
 
     # -------------------------------------------------
@@ -211,16 +461,32 @@ def show_essay_corrector(user_id: str):
 
         if st.button("🎲 出題"):
             with st.spinner("Firestoreから履歴を確認中..."):
-                recent_questions = get_recent_questions(user_id, level, mode_type)
-            with st.spinner("新しい問題を生成中..."):
-                question = generate_question(level, recent_questions, mode_type)
-                st.session_state["question"] = question
-                save_history(user_id, {
-                    "level": level,
-                    "mode": mode_type,
-                    "question": question,
-                    "timestamp": datetime.now()
-                })
+                seen = get_seen_questions(user_id, level, mode_type)
+                recent_questions = [e["q"] for e in seen or []]
+            # 🏦 事前生成プールに未出題の問題があればそれを使う（生成待ちなし）
+            question = pick_question(level, mode_type, {e["h"] for e in seen or []}, recent_questions)
+            if question is None:
+                # ⚡ プールが空のときだけその場で生成。文字を流し込み、完成したら下のお題ボックスに差し替える
+                live = st.empty()
+                for _ in range(MAX_QUESTION_RETRIES):
+                    outcome = StreamOutcome()
+                    with live.container():
+                        question = st.write_stream(stream_question(level, mode_type, outcome)).strip()
+                    # 🔁 過去問の言い換えだったら作り直す
+                    if not outcome.ok or not find_near_duplicate(question, recent_questions):
+                        break
+                live.empty()
+                if not outcome.ok:
+                    # ❌ 生成に失敗した文字列はお題にしない（履歴・既出リストにも入れない）
+                    st.error(outcome.error)
+                    question = ""
+            st.session_state["question"] = question
+            if question:
+                record_seen_question(user_id, level, mode_type, question, seen)
+                st.session_state["attempt"] = {
+                    "id": start_attempt(user_id, level, mode_type, question),
+                    "question": question
+                }
 
         # --- 出題表示 ---
         if st.session_state["question"]:
@@ -256,38 +522,76 @@ def show_essay_corrector(user_id: str):
             )
 
             img_file = st.camera_input("⬇️ 撮影する（端末には保存されません）")
+            one_shot = st.toggle("⚡ 読み取りと添削を1回で行う（添削ボタンでまとめて処理）", key="ocr_one_shot")
             extracted_text = None
+            pending_image = None
             if img_file:
-                st.info("📸 画像解析中...")
-                base64_img = base64.b64encode(img_file.getvalue()).decode("utf-8")
-                with st.spinner("文字を読み取っています..."):
-                    extracted_text = extract_text_from_image_bytes(base64_img)
-                st.success("✅ 読み取り完了！")
-                st.text_area("読み取った英文", extracted_text, height=150)
+                if one_shot:
+                    extracted_text = get_cached_ocr(img_file.getvalue())
+                    if extracted_text is None:
+                        pending_image = img_file.getvalue()
+                        st.caption("✏️ 『添削する』を押すと、読み取りと添削を同時に行います。")
+                else:
+                    st.info("📸 画像解析中...")
+                    try:
+                        with st.spinner("文字を読み取っています..."):
+                            # 同じ写真は再実行（添削ボタン等）でも読み取り直さない
+                            extracted_text = ocr_image(img_file.getvalue())
+                    except Exception as e:
+                        # ❌ エラー文は英文として扱わない（添削・履歴に回さない）
+                        st.error(f"❌ 画像読取エラー: {e}")
+                    else:
+                        st.success("✅ 読み取り完了！")
+                if extracted_text is not None:
+                    st.text_area("読み取った英文", extracted_text, height=150)
 
         # --- 添削 ---
         if st.button("✏️ 添削する"):
             essay_text = extracted_text or user_input.strip()
-            if not essay_text:
+            if not essay_text and pending_image is None:
                 st.warning("⚠ 英文を入力または撮影してください。")
             elif not st.session_state["question"]:
                 st.warning("⚠ まず『出題』ボタンを押してください。")
             else:
-                with st.spinner("添削中..."):
-                    prompt = (PROMPT_EXAM if mode_type == "和文英訳" else PROMPT_THEME).format(
+                template = PROMPT_EXAM if mode_type == "和文英訳" else PROMPT_THEME
+                outcome = StreamOutcome()
+                if pending_image is not None:
+                    try:
+                        with st.spinner("📷 読み取り＋添削中..."):
+                            essay_text, result = correct_essay_from_image(
+                                pending_image, template, st.session_state["question"]
+                            )
+                    except Exception as e:
+                        outcome.error = f"❌ 添削エラー: {e}"
+                        st.error(outcome.error)
+                    else:
+                        st.markdown(f"**📷 読み取った英文：** {essay_text}")
+                        st.markdown("### 📘 添削結果")
+                        st.write(result)
+                else:
+                    prompt = template.format(
                         japanese_prompt=st.session_state["question"],
                         theme_prompt=st.session_state["question"],
                         user_essay=essay_text
                     )
-                    result = correct_essay(prompt)
+                    key = correction_cache_key(template, st.session_state["question"], essay_text)
                     st.markdown("### 📘 添削結果")
-                    st.write(result)
+                    # ⚡ 届いた分から表示し、最後まで出たら全文を履歴に保存
+                    result = st.write_stream(stream_correction(prompt, cache_key=key, outcome=outcome)).strip()
+                # 📝 出題時に作った挑戦文書へ書き込む（無ければ1文書として新規作成）。失敗した添削は保存しない
+                attempt = st.session_state.get("attempt") or {}
+                if not outcome.ok:
+                    st.caption("添削に失敗したため、履歴には保存していません。")
+                elif attempt.get("question") == st.session_state["question"]:
+                    finish_attempt(user_id, attempt["id"], essay_text, result)
+                else:
                     save_history(user_id, {
                         "mode": mode_type,
                         "level": level,
                         "question": st.session_state["question"],
                         "user_input": essay_text,
                         "correction": result,
+                        "status": "corrected",
                         "timestamp": datetime.now()
                     })
 
@@ -319,26 +623,54 @@ def show_essay_corrector(user_id: str):
             )
 
             img_file = st.camera_input("⬇️ 撮影する（端末には保存されません）")
+            one_shot = st.toggle("⚡ 読み取りと添削を1回で行う（添削ボタンでまとめて処理）", key="ocr_one_shot")
             extracted_text = None
+            pending_image = None
             if img_file:
-                base64_img = base64.b64encode(img_file.getvalue()).decode("utf-8")
-                with st.spinner("画像から英文を抽出中..."):
-                    extracted_text = extract_text_from_image_bytes(base64_img)
-                st.text_area("読み取った英文", extracted_text, height=150)
+                if one_shot:
+                    extracted_text = get_cached_ocr(img_file.getvalue())
+                    if extracted_text is None:
+                        pending_image = img_file.getvalue()
+                        st.caption("✏️ 『添削する』を押すと、読み取りと添削を同時に行います。")
+                else:
+                    try:
+                        with st.spinner("画像から英文を抽出中..."):
+                            extracted_text = ocr_image(img_file.getvalue())
+                    except Exception as e:
+                        st.error(f"❌ 画像読取エラー: {e}")
+                if extracted_text is not None:
+                    st.text_area("読み取った英文", extracted_text, height=150)
 
         if st.button("✏️ 添削する"):
             essay_text = extracted_text or user_input.strip()
-            if not essay_text:
+            if not essay_text and pending_image is None:
                 st.warning("⚠ 英文を入力または撮影してください。")
             else:
-                with st.spinner("添削中..."):
+                outcome = StreamOutcome()
+                if pending_image is not None:
+                    try:
+                        with st.spinner("📷 読み取り＋添削中..."):
+                            essay_text, result = correct_essay_from_image(pending_image, PROMPT_FREE)
+                    except Exception as e:
+                        outcome.error = f"❌ 添削エラー: {e}"
+                        st.error(outcome.error)
+                    else:
+                        st.markdown(f"**📷 読み取った英文：** {essay_text}")
+                        st.markdown("### 📘 添削結果")
+                        st.write(result)
+                else:
                     prompt = PROMPT_FREE.format(sentence=essay_text)
-                    result = correct_essay(prompt)
+                    key = correction_cache_key(PROMPT_FREE, "", essay_text)
                     st.markdown("### 📘 添削結果")
-                    st.write(result)
+                    result = st.write_stream(stream_correction(prompt, cache_key=key, outcome=outcome)).strip()
+                # 失敗した添削は履歴に保存しない
+                if not outcome.ok:
+                    st.caption("添削に失敗したため、履歴には保存していません。")
+                else:
                     save_history(user_id, {
                         "mode": "自由添削",
                         "user_input": essay_text,
                         "correction": result,
+                        "status": "corrected",
                         "timestamp": datetime.now()
                     })
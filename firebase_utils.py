@@ -2,23 +2,84 @@
 # firebase_utils.py（完全安定版・Cloud & Local 両対応）
 # =============================================
 
-import pandas as pd
+from __future__ import annotations
+
 import hashlib
+import itertools
+# ⚠️ services は gRPC の fork 設定を行うため firebase_admin より先に import する
+from services import ServiceProxy, get_db, grpc_channel_options, lazy_import
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
+from google.cloud.firestore import Client as FirestoreClient
+from google.cloud.firestore_v1.services.firestore import client as firestore_gapic_client
+from google.cloud.firestore_v1.services.firestore.transports.grpc import FirestoreGrpcTransport
+from google.cloud.firestore_v1.field_path import FieldPath
 from dotenv import load_dotenv
 import os
-import json
 import streamlit as st
-from typing import Dict
+from typing import Dict, Iterator, List
+
+# 💤 名簿取込・一覧でしか使わないため、ログイン画面では読み込まない
+pd = lazy_import("pandas")
+
+
+# ⚠️ google-cloud-firestore には gRPC チャネル設定を渡す公開 API が無いため、
+#    チャネルを作る GAPIC トランスポート（公開クラス）だけを差し替える。
+#    差し替え口の _firestore_api は非公開なので、requirements.txt で版を固定し、
+#    構造が変わっていたらクライアント作成時に RuntimeError で止める（黙って既定設定に戻さない）。
+class _TunedGrpcTransport(FirestoreGrpcTransport):
+    """create_channel に環境変数由来の gRPC オプション（keepalive・メッセージ上限）を渡すトランスポート"""
+
+    @classmethod
+    def create_channel(cls, *args, **kwargs):
+        kwargs["options"] = grpc_channel_options()
+        return super().create_channel(*args, **kwargs)
+
+
+class _TunedFirestoreClient(FirestoreClient):
+    @property
+    def _firestore_api(self):
+        # 処理本体（エミュレーター分岐を含む）はライブラリのまま。トランスポートのクラスだけ変える
+        return self._firestore_api_helper(
+            _TunedGrpcTransport,
+            firestore_gapic_client.FirestoreClient,
+            firestore_gapic_client,
+        )
+
+
+def _check_tuned_client(client: _TunedFirestoreClient):
+    """差し替えたトランスポートが実際に使われているか確認（ライブラリ更新で外れたら即エラー）"""
+    if not hasattr(FirestoreClient, "_firestore_api_helper"):
+        raise RuntimeError("google-cloud-firestore の内部 API が変わりました（requirements.txt の版を確認してください）")
+    client._firestore_api
+    if not isinstance(getattr(client, "_transport", None), _TunedGrpcTransport):
+        raise RuntimeError("Firestore の gRPC 設定を適用できませんでした（google-cloud-firestore の版を確認してください）")
+
+
+def _new_firestore_client():
+    """このプロセス専用の Firestore クライアントを作る
+
+    firestore.client() はアプリ単位でキャッシュされ fork 先でも親と同じチャネルを返すため使わない。
+    """
+    app = firebase_admin.get_app()
+    client = _TunedFirestoreClient(
+        project=app.project_id,
+        credentials=app.credential.get_credential(),
+    )
+    _check_tuned_client(client)
+    return client
 
 
 def init_firebase():
+    """Firebase アプリを初期化し、このプロセス用の Firestore クライアントを返す
+
+    通常は services.get_db()（または下の db / USERS）経由で使い、直接呼ぶのはレジストリのみ。
+    """
     print("🔍 DEBUG: Firebase 初期化開始")
 
     if firebase_admin._apps:
         print("ℹ️ Firebase はすでに初期化済み")
-        return firestore.client()
+        return _new_firestore_client()
 
     try:
         # ✅ 1️⃣ Streamlit Cloud：Secretsに [firebase] がある場合
@@ -42,9 +103,9 @@ def init_firebase():
             firebase_admin.initialize_app(cred)
             print(f"✅ Firebase initialized via local JSON ({firebase_path})")
 
-        db = firestore.client()
+        client = _new_firestore_client()
         print("✅ Firestore client ready")
-        return db
+        return client
 
     except Exception as e:
         msg = f"❌ Firebase初期化エラー: {e}"
@@ -55,10 +116,16 @@ def init_firebase():
         raise e
 
 # ==============================
-# 🔹 Firestore クライアント生成
+# 🔹 Firestore クライアント（遅延・プロセス単位）
 # ==============================
-db = init_firebase()
-USERS = db.collection("users")
+# import 時には接続しない。初めて使った時点で services のレジストリが生成し、
+# fork 後の子プロセスでは自動で作り直される。
+def _users_collection():
+    return get_db().collection("users")
+
+
+db = ServiceProxy(get_db)
+USERS = ServiceProxy(_users_collection)
 
 
 
@@ -111,11 +178,20 @@ def update_user_password(member_id: str, new_password: str):
 # ==============================
 # 🧰 ヘルパー：列名マップ＆前処理
 # ==============================
+def _clean_header(c) -> str:
+    """列名の全角スペース除去・トリム"""
+    return str(c).strip().replace("　", "")
+
+
 def _normalize_columns(df: pd.DataFrame) -> Dict[str, str]:
     """列名の全角スペース除去・トリム＋ゆらぎ対応して、標準キーにマッピング"""
     # 列名正規化
-    df.columns = [str(c).strip().replace("　", "") for c in df.columns]
+    df.columns = [_clean_header(c) for c in df.columns]
+    return _resolve_columns(list(df.columns))
 
+
+def _resolve_columns(columns: List[str]) -> Dict[str, str]:
+    """正規化済みの列名リストから、ゆらぎを吸収して標準キー → 実列名のマップを作る"""
     # 候補パターン
     candidates = {
         "code": ["コード", "ｺｰﾄﾞ", "code", "Code", "CODE"],
@@ -126,11 +202,11 @@ def _normalize_columns(df: pd.DataFrame) -> Dict[str, str]:
 
     resolved = {}
     for key, opts in candidates.items():
-        found = next((c for c in df.columns if c in opts), None)
+        found = next((c for c in columns if c in opts), None)
         if not found and key in ("family", "given"):
             # 姓名が1列（例：「氏名」）しかない場合に備えて
             if key == "family":
-                found = next((c for c in df.columns if c in ["氏名", "名前"]), None)
+                found = next((c for c in columns if c in ["氏名", "名前"]), None)
             else:
                 found = None
         if found:
@@ -173,139 +249,484 @@ def _ffill_code_column(df: pd.DataFrame, code_col: str) -> pd.Series:
 # ==============================
 # 🧾 Firestore 登録処理
 # ==============================
-def import_students_from_excel_and_csv(excel_file, csv_file):
+# コード先頭桁 → 学年
+GRADE_BY_CODE_HEAD = {
+    "1": "中1",
+    "2": "中2",
+    "3": "中3",
+    "4": "高1",
+    "5": "高2",
+    "6": "高3",
+}
+
+# Firestore の WriteBatch / get_all は 1 回 500 件まで
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def _clean_str_series(s: pd.Series) -> pd.Series:
+    """NaN→空文字、全角空白除去、トリム、小数表現（'1001.0'）の除去をまとめて行う"""
+    return (
+        s.fillna("")
+        .astype(str)
+        .str.replace("\u3000", "", regex=False)
+        .str.strip()
+        .replace({"nan": "", "NaN": "", "None": ""})
+        .str.replace(r"\.0$", "", regex=True)
+    )
+
+
+def _load_password_table(csv_file) -> pd.DataFrame:
     """
-    Excel（会員番号, 姓/性, 名 or 氏名, コード）＋CSV（会員番号, 初期PW）を統合してFirestoreに登録。
-    コード列は空欄を上の値で前方補完して確実に埋める。
-    既存会員番号はスキップ。
+    CSV（1列目=会員番号, 2列目=初期PW）を読み込み、member_id / init_pw の2列に揃える。
+    同じ会員番号が複数あるときは先頭行を採用。
     """
-    try:
-        # --- Excel読み込み＆列名正規化 ---
-        df_excel = pd.read_excel(excel_file)
-        col_map = _normalize_columns(df_excel)
-
-        # --- コード列の補完 ---
-        code_col = col_map.get("code")
-        if code_col:
-            df_excel[code_col] = _ffill_code_column(df_excel, code_col)
-        else:
-            print("❌ コード列が見つかりません。登録をスキップします。")
-            return pd.DataFrame()
+    df_csv = pd.read_csv(csv_file)
+    df_csv.columns = [str(c).strip().replace("　", "") for c in df_csv.columns]
+    if df_csv.shape[1] < 2:
+        raise ValueError("CSVの列数が不足しています（会員番号/初期PWの2列必要）")
 
-        # --- CSV読み込み（会員番号, 初期PW） ---
-        df_csv = pd.read_csv(csv_file)
-        df_csv.columns = [str(c).strip().replace("　", "") for c in df_csv.columns]
-        # 1列目=会員番号, 2列目=初期PW として扱う（列名ゆらぎ対策）
-        if df_csv.shape[1] < 2:
-            print("❌ CSVの列数が不足しています（会員番号/初期PWの2列必要）。")
-            return pd.DataFrame()
-        df_csv.iloc[:, 0] = df_csv.iloc[:, 0].astype(str).str.strip()
-        df_csv.iloc[:, 1] = df_csv.iloc[:, 1].astype(str).str.strip()
-
-        registered = []
-
-        # --- 行ごと処理 ---
-        for _, row in df_excel.iterrows():
-            try:
-                # 会員番号
-                member_col = col_map.get("member")
-                if not member_col or pd.isna(row.get(member_col)):
+    df_pw = pd.DataFrame({
+        "member_id": _clean_str_series(df_csv.iloc[:, 0]),
+        "init_pw": df_csv.iloc[:, 1].astype(str).str.strip(),
+    })
+    df_pw = df_pw[df_pw["member_id"] != ""]
+    return df_pw.drop_duplicates(subset="member_id", keep="first")
+
+
+def _build_roster_frame(df_excel: pd.DataFrame, col_map: Dict[str, str]) -> pd.DataFrame:
+    """
+    正規化済みの Excel から member_id / name / class_code の3列を列演算で組み立てる。
+    （コード列は _ffill_code_column で補完済みである前提）
+    """
+    member_col = col_map.get("member")
+    if not member_col:
+        print("❌ 会員番号列が見つかりません。")
+        return pd.DataFrame(columns=["member_id", "name", "class_code"])
+
+    family_col = col_map.get("family")
+    given_col = col_map.get("given")
+    if family_col and given_col:
+        name = (_clean_str_series(df_excel[family_col]) + " " + _clean_str_series(df_excel[given_col])).str.strip()
+    elif family_col:
+        # 氏名1列（例：「氏名」「名前」）のとき
+        name = _clean_str_series(df_excel[family_col])
+    else:
+        name = pd.Series("", index=df_excel.index)
+
+    df_roster = pd.DataFrame({
+        "member_id": _clean_str_series(df_excel[member_col]),
+        "name": name,
+        "class_code": _clean_str_series(df_excel[col_map["code"]]),
+    })
+    df_roster = df_roster[df_roster["member_id"] != ""]
+
+    no_code = df_roster["class_code"] == ""
+    for member_id in df_roster.loc[no_code, "member_id"]:
+        print(f"⚠ {member_id}: コードが空です。スキップ。")
+    return df_roster[~no_code]
+
+
+def fetch_existing_ids(member_ids) -> set:
+    """users に既に存在する会員番号を get_all でまとめて確認（1往復 500 件）"""
+    existing = set()
+    ids = [mid for mid in member_ids if mid]  # 空の ID は文書を指さない（get_all がエラーになる）
+    for i in range(0, len(ids), FIRESTORE_BATCH_LIMIT):
+        refs = [USERS.document(mid) for mid in ids[i:i + FIRESTORE_BATCH_LIMIT]]
+        for snap in db.get_all(refs, field_paths=["member_id"]):
+            if snap.exists:
+                existing.add(snap.id)
+    return existing
+
+
+def _commit_in_batches(docs: Dict[str, dict], updates: Dict[str, dict] = None):
+    """
+    {会員番号: ドキュメント} を set、{会員番号: 変更フィールド} を update として
+    500 件ずつ WriteBatch でコミットする
+    """
+    ops = [("set", mid, data) for mid, data in docs.items()]
+    ops += [("update", mid, data) for mid, data in (updates or {}).items()]
+    for i in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for op, member_id, data in ops[i:i + FIRESTORE_BATCH_LIMIT]:
+            if op == "set":
+                batch.set(USERS.document(member_id), data)
+            else:
+                batch.update(USERS.document(member_id), data)
+        batch.commit()
+
+
+# 差分更新（upsert）で比較・更新する項目
+ROSTER_SYNC_FIELDS = ["name", "class_code", "grade"]
+
+# 取込結果に行ごとの内容を残す件数（件数そのものは全件数える）
+ROSTER_REPORT_SAMPLE_ROWS = 200
+ROSTER_REPORT_COLUMNS = ["処理", "会員番号", "氏名", "クラス", "学年", "変更項目"]
+
+
+class RosterImportReport:
+    """名簿取込の結果：処理ごとの件数＋更新・スキップ行の見本（最大 ROSTER_REPORT_SAMPLE_ROWS 件）
+
+    行ごとの結果は持たないので、名簿が何行あっても大きさは変わらない。
+    """
+
+    KINDS = ("新規", "更新", "変更なし", "登録済み", "初期PWなし")
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.KINDS, 0)
+        self.samples = []
+
+    def add(self, kind: str, count: int, rows=()):
+        """kind の件数を足し、rows（ROSTER_REPORT_COLUMNS をキーにした dict）を見本の空きぶんだけ残す"""
+        self.counts[kind] += int(count)
+        room = ROSTER_REPORT_SAMPLE_ROWS - len(self.samples)
+        if room > 0:
+            self.samples.extend(itertools.islice(rows, room))
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def sample_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.samples, columns=ROSTER_REPORT_COLUMNS)
+
+
+def load_existing_roster(fields: List[str] = None) -> pd.DataFrame:
+    """
+    users を select() で必要な項目だけ射影して1回で読み込み、
+    会員番号をインデックスにした DataFrame を返す（PWハッシュ等は転送しない）
+    """
+    fields = fields or ROSTER_SYNC_FIELDS
+    rows = []
+    for doc in USERS.select(fields).stream():
+        data = doc.to_dict() or {}
+        rows.append({"member_id": doc.id, **{f: data.get(f) for f in fields}})
+    return pd.DataFrame(rows, columns=["member_id", *fields]).set_index("member_id")
+
+
+def _new_user_docs(df_new: pd.DataFrame) -> Dict[str, dict]:
+    """新規登録行（member_id, name, class_code, grade, init_pw）→ users ドキュメント"""
+    # PWハッシュ（同じ初期PWは1回だけ計算）
+    unique_pw = df_new["init_pw"].unique()
+    df_new["init_password_hash"] = df_new["init_pw"].map(dict(zip(unique_pw, map(hash_password, unique_pw))))
+
+    return {
+        r.member_id: {
+            "member_id": r.member_id,
+            "name": r.name,
+            "class_code": r.class_code,
+            "grade": r.grade,
+            "role": "student",
+            "init_password_hash": r.init_password_hash,
+            "custom_password_hash": None,
+            "password_changed": False,
+        }
+        for r in df_new.itertuples(index=False)
+    }
+
+
+def _register_roster_frame(df_roster: pd.DataFrame, df_pw: pd.DataFrame, report: RosterImportReport,
+                           existing: pd.DataFrame = None, seen_ids: set = None, dry_run: bool = False):
+    """
+    名簿（member_id, name, class_code）と初期PW表を結合して Firestore に反映し、件数を report に足す。
+    dry_run=True のときは書き込まずに件数だけ数える（取込前の確認用）。
+    existing=None        : 未登録の生徒だけを一括登録（既存はスキップ）
+    existing=DataFrame   : 差分更新。load_existing_roster() の結果と比較し、
+                           新規は登録・既存は変わった項目だけ update する
+    seen_ids             : チャンクごとに呼ぶとき、前のチャンクで処理した会員番号（ここで追加される）。
+                           同じ会員番号は最初の行だけを使う（一括取込の drop_duplicates と同じ）
+    """
+    df_roster = df_roster.drop_duplicates(subset="member_id", keep="first")
+    if seen_ids is not None:
+        df_roster = df_roster[~df_roster["member_id"].map(seen_ids.__contains__).astype(bool)]
+        seen_ids.update(df_roster["member_id"])
+
+    # --- 初期PWを merge で付与 ---
+    merged = df_roster.merge(df_pw, on="member_id", how="left")
+
+    # --- 学年はコード先頭桁から一括判定 ---
+    merged["grade"] = merged["class_code"].str[0].map(GRADE_BY_CODE_HEAD).fillna("")
+
+    # --- 既存チェック（get_all で一括 or 読込済みの名簿） ---
+    # Index の `in` は作成済みのハッシュ表を使うので、チャンクごとに集合を作り直さない
+    known = fetch_existing_ids(merged["member_id"]) if existing is None else existing.index
+    is_existing = merged["member_id"].map(known.__contains__).astype(bool)
+
+    # --- 新規：初期PWが無い会員はスキップ ---
+    df_new = merged[~is_existing]
+    no_pw = df_new["init_pw"].isna()
+    for member_id in df_new.loc[no_pw, "member_id"]:
+        print(f"⚠ {member_id}: CSVに初期PWが見つかりません。スキップ。")
+    report.add("初期PWなし", no_pw.sum(), (
+        {"処理": "初期PWなし", "会員番号": r.member_id, "氏名": r.name, "クラス": r.class_code, "学年": r.grade}
+        for r in df_new[no_pw].itertuples(index=False)
+    ))
+    df_new = df_new[~no_pw].copy()
+    docs = _new_user_docs(df_new) if not df_new.empty else {}
+    report.add("新規", len(docs))
+
+    if existing is None:
+        if is_existing.any():
+            print(f"スキップ: {int(is_existing.sum())} 件は既に登録済み")
+        report.add("登録済み", is_existing.sum())
+        if not dry_run:
+            _commit_in_batches(docs)
+        return
+
+    # --- 既存：項目ごとの差分を列演算で計算 ---
+    df_cur = merged[is_existing].set_index("member_id")
+    before = existing.reindex(df_cur.index)[ROSTER_SYNC_FIELDS].fillna("").astype(str)
+    after = df_cur[ROSTER_SYNC_FIELDS].fillna("").astype(str)
+    changed = before.ne(after)
+    changed_ids = changed.index[changed.any(axis=1)]
+
+    updates = {
+        member_id: {f: after.at[member_id, f] for f in ROSTER_SYNC_FIELDS if changed.at[member_id, f]}
+        for member_id in changed_ids
+    }
+    if not dry_run:
+        _commit_in_batches(docs, updates)
+
+    report.add("更新", len(changed_ids), (
+        {
+            "処理": "更新",
+            "会員番号": mid,
+            "氏名": after.at[mid, "name"],
+            "クラス": after.at[mid, "class_code"],
+            "学年": after.at[mid, "grade"],
+            "変更項目": ", ".join(f"{f}: {before.at[mid, f]}→{after.at[mid, f]}" for f in fields),
+        }
+        for mid, fields in updates.items()
+    ))
+    report.add("変更なし", len(df_cur) - len(changed_ids))
+
+
+# ==============================
+# 🌊 大容量名簿のストリーミング取込
+# ==============================
+# これ以上のサイズの Excel は openpyxl read_only で1行ずつ読む
+STREAMING_IMPORT_THRESHOLD_BYTES = 5 * 1024 * 1024
+NO_ROSTER_SHEET_MESSAGE = "会員番号・コード列のあるシートが Excel に見つかりません"
+ROSTER_CHUNK_SIZE = FIRESTORE_BATCH_LIMIT
+
+
+def _clean_cell(v) -> str:
+    """セル値を文字列に整形（None/'nan'→空文字、10100.0→'10100'、全角空白除去）"""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    t = str(v).replace("\u3000", "").strip()
+    return "" if t in ("nan", "NaN", "None") else t
+
+
+def iter_roster_chunks_from_excel(excel_file, chunk_size: int = ROSTER_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Excel の全シートを openpyxl read_only で1行ずつ読み、
+    member_id / name / class_code の DataFrame を chunk_size 行ずつ返す。
+    列名解決はシートごとに1回、コード列の前方補完は読みながら行う。
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    usable_sheets = 0
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header:
+                continue
+
+            columns = [_clean_header(c) for c in header]
+            col_map = _resolve_columns(columns)
+            if "code" not in col_map or "member" not in col_map:
+                print(f"⚠ シート『{ws.title}』: 会員番号/コード列が無いためスキップ。")
+                continue
+            usable_sheets += 1
+            idx = {key: columns.index(col) for key, col in col_map.items()}
+            family_i = idx.get("family")
+            given_i = idx.get("given") if family_i is not None else None
+
+            def cell(row, i):
+                return _clean_cell(row[i]) if i is not None and i < len(row) else ""
+
+            last_code = ""
+            buf = []
+            for row in rows:
+                code = cell(row, idx["code"])
+                if code:
+                    last_code = code
+
+                member_id = cell(row, idx["member"])
+                if not member_id:
                     continue
-                member_id = str(row[member_col]).strip()
-
-                # 氏名
-                family_col = col_map.get("family")
-                given_col  = col_map.get("given")
-                if family_col and given_col:
-                    family = str(row.get(family_col, "")).strip()
-                    given  = str(row.get(given_col, "")).strip()
-                    name = f"{family} {given}".strip()
-                else:
-                    # 氏名1列（例：「氏名」「名前」）のとき
-                    fullname_col = col_map.get("family")  # family に氏名1列が入っているケース
-                    name = str(row.get(fullname_col, "")).strip()
-
-                # クラスコード（補完済）
-                class_code = str(row.get(code_col, "")).strip()
-                if class_code == "" or class_code.lower() == "nan":
-                    # ここまで来た時点で本来埋まっている想定だが、念のためスキップ
+                if not last_code:
                     print(f"⚠ {member_id}: コードが空です。スキップ。")
                     continue
 
-                # 🔹 追加：コード先頭桁から学年を自動判定（最小限）
-                head = class_code[0]
-                grade = {
-                    "1": "中1",
-                    "2": "中2",
-                    "3": "中3",
-                    "4": "高1",
-                    "5": "高2",
-                    "6": "高3",
-                }.get(head, "")
-
-                # CSVから初期PW取得（1列目=会員番号, 2列目=初期PW）
-                hit = df_csv[df_csv.iloc[:, 0] == member_id]
-                if hit.empty:
-                    print(f"⚠ {member_id}: CSVに初期PWが見つかりません。スキップ。")
-                    continue
-                init_pw = str(hit.iloc[0, 1]).strip()
-                hashed_init = hash_password(init_pw)
+                if given_i is not None:
+                    name = f"{cell(row, family_i)} {cell(row, given_i)}".strip()
+                else:
+                    name = cell(row, family_i)
 
-                # 既存チェック
-                doc_ref = USERS.document(member_id)
-                if doc_ref.get().exists:
-                    print(f"スキップ: {member_id} は既に登録済み")
-                    continue
+                buf.append((member_id, name, last_code))
+                if len(buf) >= chunk_size:
+                    yield pd.DataFrame(buf, columns=["member_id", "name", "class_code"])
+                    buf = []
+
+            if buf:
+                yield pd.DataFrame(buf, columns=["member_id", "name", "class_code"])
+    finally:
+        wb.close()
+    if not usable_sheets:
+        raise ValueError(NO_ROSTER_SHEET_MESSAGE)
+
+
+def import_students_streaming(excel_file, csv_file, chunk_size: int = ROSTER_CHUNK_SIZE,
+                              upsert: bool = False, dry_run: bool = False) -> RosterImportReport:
+    """
+    大容量名簿用：Excel を chunk_size 行ずつ読み、そのままバッチ書き込みまで流す。
+    ファイルサイズに関係なくメモリに載るのは1チャンク分＋初期PW表（upsert 時は射影済み名簿）と、
+    処理済み会員番号の集合・件数つきの結果（RosterImportReport）のみ。
+    """
+    try:
+        report = RosterImportReport()
+        df_pw = _load_password_table(csv_file)
+        if df_pw.empty:
+            return report
+
+        existing = load_existing_roster() if upsert else None
+        seen_ids = set()
 
-                # Firestore登録（🔹 grade を追加）
-                doc_ref.set({
-                    "member_id": member_id,
-                    "name": name,
-                    "class_code": class_code,
-                    "grade": grade,  # ← 追加
-                    "role": "student",
-                    "init_password_hash": hashed_init,
-                    "custom_password_hash": None,
-                    "password_changed": False
-                })
-
-                registered.append({
-                    "会員番号": member_id,
-                    "氏名": name,
-                    "クラス": class_code,
-                    "学年": grade,  # ← 表示にも追加
-                    "初期PW": init_pw
-                })
-
-            except Exception as e:
-                print(f"登録エラー: {row} → {e}")
-
-        return pd.DataFrame(registered)
+        for i, chunk in enumerate(iter_roster_chunks_from_excel(excel_file, chunk_size), start=1):
+            _register_roster_frame(chunk, df_pw, report, existing, seen_ids, dry_run)
+            print(f"✅ チャンク{i}: {len(chunk)} 行を処理（累計 {report.total} 件）")
+        return report
 
     except Exception as e:
+        # 失敗は呼び出し側へ（空の結果を返すと「取込済み」と区別できない）
         print(f"❌ 登録中エラー: {e}")
-        return pd.DataFrame()
+        raise
+
+
+def _upload_size(f) -> int:
+    size = getattr(f, "size", None)
+    if size is not None:
+        return size
+    return f.getbuffer().nbytes if hasattr(f, "getbuffer") else 0
+
+
+def roster_upload_key(excel_file, csv_file) -> str:
+    """
+    アップロードされた Excel / CSV の中身から取込ジョブのキー（SHA256）を作る。
+    同じファイルの組み合わせなら再実行のたびに同じキーになる。
+    """
+    h = hashlib.sha256()
+    for f in (excel_file, csv_file):
+        data = f.getvalue()
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def import_students_from_excel_and_csv(excel_file, csv_file, streaming: bool = None,
+                                       upsert: bool = False, dry_run: bool = False) -> RosterImportReport:
+    """
+    Excel（会員番号, 姓/性, 名 or 氏名, コード）＋CSV（会員番号, 初期PW）を統合してFirestoreに登録。
+    Excel は全シートを読む（会員番号・コード列の無いシートはスキップ。ストリーミング取込と同じ）。
+    コード列は空欄を上の値で前方補完して確実に埋める。
+    既存会員番号はスキップ（upsert=True のときは氏名・クラス・学年の変更分だけ更新）。
+    結果は件数＋更新・スキップ行の見本（RosterImportReport）。読み込み・書き込みに失敗した場合は例外を送出する。
+    dry_run=True のときは Firestore を読むだけで書き込まない（取込前に新規・更新・変更なしの件数を確認する）。
+    行ループは使わず、merge → 一括ハッシュ → get_all → 500件バッチ書き込みで処理する。
+    streaming=None のときは Excel サイズで判定し、大きいファイルはストリーミング取込に切り替える。
+    """
+    # 確認（dry_run）→ 取込で同じアップロードを2回読むため、毎回先頭から読む
+    for f in (excel_file, csv_file):
+        f.seek(0)
+    if streaming is None:
+        streaming = _upload_size(excel_file) >= STREAMING_IMPORT_THRESHOLD_BYTES
+    if streaming:
+        return import_students_streaming(excel_file, csv_file, upsert=upsert, dry_run=dry_run)
+
+    try:
+        # --- Excel読み込み（ストリーミング取込と同じく全シート） ---
+        frames = []
+        for sheet_name, df_excel in pd.read_excel(excel_file, sheet_name=None).items():
+            col_map = _normalize_columns(df_excel)
+            if "code" not in col_map or "member" not in col_map:
+                print(f"⚠ シート『{sheet_name}』: 会員番号/コード列が無いためスキップ。")
+                continue
+            # --- コード列の補完（シートごと） ---
+            df_excel[col_map["code"]] = _ffill_code_column(df_excel, col_map["code"])
+            frames.append(_build_roster_frame(df_excel, col_map))
+        if not frames:
+            raise ValueError(NO_ROSTER_SHEET_MESSAGE)
+
+        # --- CSV読み込み（会員番号, 初期PW） ---
+        report = RosterImportReport()
+        df_pw = _load_password_table(csv_file)
+        if df_pw.empty:
+            return report
+
+        df_roster = pd.concat(frames, ignore_index=True)
+        existing = load_existing_roster() if upsert else None
+        _register_roster_frame(df_roster, df_pw, report, existing, dry_run=dry_run)
+        return report
+
+    except Exception as e:
+        # 失敗は呼び出し側へ（空の結果を返すと「取込済み」と区別できない）
+        print(f"❌ 登録中エラー: {e}")
+        raise
 
 
 # ==============================
 # 📋 Firestore 全ユーザー一覧取得
 # ==============================
-def fetch_all_users():
+# 一覧に必要な項目だけ射影（PWハッシュは画面側へ転送しない）
+USER_LIST_FIELDS = ["member_id", "name", "class_code", "grade", "password_changed"]
+USER_PAGE_SIZE = 50
+
+
+def _user_list_row(doc) -> dict:
+    data = doc.to_dict() or {}
+    return {
+        "会員番号": data.get("member_id") or doc.id,
+        "氏名": data.get("name"),
+        "クラス": data.get("class_code"),
+        "学年": data.get("grade"),
+        "PW変更済": "✅" if data.get("password_changed") else "❌"
+    }
+
+
+def fetch_users_page(page_size: int = USER_PAGE_SIZE, start_after: str = None,
+                     grade: str = None, class_code: str = None, password_changed: bool = None):
     """
-    Firestoreの users コレクションをDataFrameとして返す。
+    users をページ単位で取得する。
+    - select() で一覧表示用の項目だけを射影
+    - 学年・クラスコード・PW変更済みはサーバー側で絞り込み（等価条件のみ）
+    - 並び順はドキュメントID（＝会員番号）。等価条件＋ID順なので複合インデックス不要
+    戻り値: (DataFrame, 次ページのカーソル or None)
     """
     try:
-        users = []
-        for doc in USERS.stream():
-            data = doc.to_dict()
-            users.append({
-                "会員番号": data.get("member_id"),
-                "氏名": data.get("name"),
-                "クラス": data.get("class_code"),
-                "学年": data.get("grade"),  # ← 学年も表示（最小限の追加）
-                "PW変更済": "✅" if data.get("password_changed") else "❌"
-            })
-        return pd.DataFrame(users)
+        query = USERS.select(USER_LIST_FIELDS)
+        if grade:
+            query = query.where("grade", "==", grade)
+        if class_code:
+            query = query.where("class_code", "==", class_code)
+        if password_changed is not None:
+            query = query.where("password_changed", "==", password_changed)
+
+        query = query.order_by(FieldPath.document_id())
+        if start_after:
+            query = query.start_after({FieldPath.document_id(): start_after})
+
+        # 1件多く取って次ページの有無を判定
+        docs = list(query.limit(page_size + 1).stream())
+        has_next = len(docs) > page_size
+        docs = docs[:page_size]
+
+        next_cursor = docs[-1].id if has_next and docs else None
+        return pd.DataFrame([_user_list_row(d) for d in docs], columns=["会員番号", "氏名", "クラス", "学年", "PW変更済"]), next_cursor
     except Exception as e:
         print(f"❌ Firestore一覧取得エラー: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
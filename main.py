@@ -3,11 +3,8 @@
 # =============================================
 
 import streamlit as st
-import os
-from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
-from firebase_utils import verify_password
+# ⚠️ Firestore（grpc）を読み込む前に gRPC の fork 設定を済ませるため、最初に services を読み込む
+import services
 
 # --- ページ設定 ---
 st.set_page_config(page_title="エデュカアプリログイン", layout="centered")
@@ -65,36 +62,15 @@ div[data-testid="stAppViewContainer"] > section:first-child {
 """, unsafe_allow_html=True)
 
 # ================================
-# 🔥 Firebase 初期化（現状のコードを完全継承）
+# 🔥 Firebase 初期化（firebase_utils.init_firebase に一本化）
 # ================================
-load_dotenv()
-
-if not firebase_admin._apps:
-    try:
-        # --- Streamlit Cloud ---
-        if "firebase" in st.secrets:
-            firebase_config = dict(st.secrets["firebase"])
-            cred = credentials.Certificate(firebase_config)
-        else:
-            # --- ローカル ---
-            firebase_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "educa-app-firebase-adminsdk.json")
-            if not os.path.exists(firebase_path):
-                raise FileNotFoundError(f"Firebase 認証ファイルが見つかりません: {firebase_path}")
-            cred = credentials.Certificate(firebase_path)
-
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-
-    except Exception as e:
-        st.error(f"❌ Firebase 初期化エラー: {e}")
-        st.stop()
-else:
-    db = firestore.client()
-
-# ============================
-# Firestore USERS
-# ============================
-USERS = db.collection("users")
+# db / USERS は遅延生成なので、import だけでは認証情報の誤りに気づけない。ここで実際に作っておく
+try:
+    from firebase_utils import verify_password, USERS
+    services.get_db()
+except Exception as e:
+    st.error(f"❌ Firebase 初期化エラー: {e}")
+    st.stop()
 
 # ============================
 # 🧠 状態
@@ -0,0 +1,80 @@
+# =============================================
+# near_duplicate.py（問題文の近似重複チェック：文字 n-gram MinHash）
+# =============================================
+# 表記ゆれ・助詞や語順の入れ替え程度しか違わない問題
+# （「私は毎朝公園を走ります。」「私は毎朝、公園で走ります」など）を
+# ローカルで検出し、出題・プール補充の段階で弾く。
+# 日本語は単語区切りが無いため、空白・記号を除いた文字 2-gram をシングルとして使う。
+# 文字 n-gram なので同義語への言い換え（「走る」「ジョギングする」）は拾えない。
+#
+# 自由英作のテーマは「〜について英語で書きなさい」のような共通の指示文が大半を占め、
+# そのまま比べると「好きな季節」「好きな食べ物」のような別テーマまで重複扱いになる。
+# そのため指示文の定型部分（QUESTION_FRAME_PATTERNS）を取り除いてから比べる。
+
+import functools
+import random
+import re
+import zlib
+
+from correction_cache import normalize_text
+from services import env_int
+
+SHINGLE_SIZE = 2
+NUM_PERM = 64
+# 推定 Jaccard 係数がこれ以上なら近似重複（QUESTION_DUP_THRESHOLD は百分率）
+# 助詞 1 つの違いで 0.6〜0.7、定型部分を除いたあと題材だけ違う文で 0.3 前後になるため、その間に置く
+DUP_THRESHOLD = env_int("QUESTION_DUP_THRESHOLD", 55) / 100
+
+# 問題文に共通する指示の定型部分（比較の前に取り除く）
+QUESTION_FRAME_PATTERNS = [
+    r"あなたの(考え|意見)を",
+    r"あなたの",
+    r"(英語|英文)で",
+    r"\d+語(程度|以上|以内)?で",
+    r"(書き|述べ|説明し|答え|訳し|表現し)(なさい|ましょう)",
+    r"(書い|述べ|説明し|答え|訳し|表現し)て(ください|みましょう)",
+    r"次の(日本文|日本語|文)を",
+    r"(について|に関して|に対する|に対して)",
+    r"(に)?賛成(です)?か反対(です)?か",
+    r"の(利点|長所|メリット)と(欠点|短所|デメリット)",
+]
+_FRAME_RE = re.compile("|".join(QUESTION_FRAME_PATTERNS))
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20241019)  # プロセス間で同じ署名になるよう固定シード
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def question_body(text: str) -> str:
+    """指示の定型部分と空白・記号を除いた本文（定型部分しか無い文はそのまま使う）"""
+    compact = re.sub(r"[\W_]+", "", normalize_text(text))
+    return re.sub(r"[\W_]+", "", _FRAME_RE.sub("", normalize_text(text))) or compact
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set[str]:
+    """問題文の本文（question_body）の文字 k-gram の集合"""
+    compact = question_body(text)
+    if len(compact) <= k:
+        return {compact}
+    return {compact[i:i + k] for i in range(len(compact) - k + 1)}
+
+
+@functools.lru_cache(maxsize=4096)
+def minhash_signature(text: str) -> tuple[int, ...]:
+    """MinHash 署名（同じ文は何度でも同じ値。プールの問題は繰り返し比べるのでキャッシュ）"""
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(text)]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+
+def similarity(text_a: str, text_b: str) -> float:
+    """推定 Jaccard 係数（0〜1）"""
+    sig_a, sig_b = minhash_signature(text_a), minhash_signature(text_b)
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def find_near_duplicate(text: str, candidates, threshold: float = DUP_THRESHOLD) -> str | None:
+    """candidates の中で text と近似重複する最初の文（無ければ None）"""
+    for other in candidates:
+        if other and similarity(text, other) >= threshold:
+            return other
+    return None
@@ -0,0 +1,116 @@
+# =============================================
+# ocr_service.py（撮影答案の文字読み取り：前処理＋Vision OCR＋結果キャッシュ）
+# =============================================
+# st.camera_input の画像は撮り直すまで毎回の再実行で同じ値が返ってくる。
+# 画像バイト列のダイジェストをキーにセッション内で結果を覚え、
+# 1枚の写真につき Vision モデルを呼ぶのは1回だけにする。
+
+import base64
+import hashlib
+import io
+
+import streamlit as st
+from PIL import Image, ImageOps
+
+from ai_gateway import AIGatewayError, chat_completion
+from services import env_int
+
+OCR_MAX_EDGE = env_int("OCR_MAX_EDGE", 1600)          # 長辺の最大ピクセル
+OCR_JPEG_QUALITY = env_int("OCR_JPEG_QUALITY", 80)
+OCR_CACHE_SIZE = 8                                    # セッションごとに覚えておく枚数
+
+
+# ==================================================
+# 🔹 OCR 前の画像縮小（スマホ写真は数MBあるため）
+# ==================================================
+def prepare_image_for_ocr(image_bytes: bytes, max_edge: int = OCR_MAX_EDGE) -> bytes:
+    """EXIF の向きを反映 → 長辺 max_edge に縮小 → グレースケール → JPEG 再圧縮
+
+    手書き文字の判読に色は不要なので、送信サイズと画像トークンを減らす。
+    読めない形式などで失敗した場合は元の画像をそのまま返す。
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("L")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            # 薄い鉛筆書きでも読みやすいよう軽くコントラストを補正
+            img = ImageOps.autocontrast(img, cutoff=1)
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+    except Exception as e:
+        print(f"⚠️ 画像前処理エラー（元画像で続行）: {e}")
+        return image_bytes
+
+
+def encode_image_for_ocr(image_bytes: bytes) -> str:
+    """前処理済み JPEG の base64 文字列（Vision API の data URL 用）"""
+    return base64.b64encode(prepare_image_for_ocr(image_bytes)).decode("utf-8")
+
+
+# ==================================================
+# 🔹 ChatGPT Vision OCR
+# ==================================================
+def extract_text_from_image_bytes(image_bytes_b64: str) -> str:
+    """画像の英文を読み取る。失敗時は AIGatewayError（エラー文を読み取り結果として返さない）"""
+    response = chat_completion(
+        "extract_text",
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "この画像に書かれている英語の文を正確に読み取り、テキストとして出力してください。"},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_bytes_b64}"}}
+                ]
+            }
+        ],
+        temperature=0
+    )
+    text = (response.choices[0].message.content or "").strip()
+    if not text:
+        raise AIGatewayError("画像から英文を読み取れませんでした。撮り直してください。")
+    return text
+
+
+# ==================================================
+# 🧠 画像ダイジェスト単位のキャッシュ
+# ==================================================
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _session_cache() -> dict:
+    """{digest: 読み取り結果}（古いものから OCR_CACHE_SIZE 件を超えた分を捨てる）"""
+    if "ocr_cache" not in st.session_state:
+        st.session_state["ocr_cache"] = {}
+    return st.session_state["ocr_cache"]
+
+
+def get_cached_ocr(image_bytes: bytes) -> str | None:
+    """この画像の読み取り結果がセッションにあれば返す"""
+    return _session_cache().get(image_digest(image_bytes))
+
+
+def remember_ocr(image_bytes: bytes, text: str):
+    """読み取り結果をセッションに保存（空の結果は保存しない）"""
+    if not text:
+        return
+    cache = _session_cache()
+    cache[image_digest(image_bytes)] = text
+    while len(cache) > OCR_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+
+def ocr_image(image_bytes: bytes) -> str:
+    """画像の英文を読み取る（同じ画像はセッション内で1回だけ Vision を呼ぶ）
+
+    失敗時は例外をそのまま送出し、キャッシュしない（次の再実行で読み取り直す）。
+    """
+    cached = get_cached_ocr(image_bytes)
+    if cached is not None:
+        return cached
+    text = extract_text_from_image_bytes(encode_image_for_ocr(image_bytes))
+    remember_ocr(image_bytes, text)
+    return text
@@ -1,15 +1,17 @@
 # =============================================
-# pages/1000_admin_menu.py（タブ方式：最安定バージョン）
+# pages/1000_admin_menu.py（ビュー切替方式：表示中のビューだけ実行）
 # =============================================
 
 import streamlit as st
-from firebase_admin import firestore
+from datetime import datetime
 
 from admin_chat import show_admin_chat
 from admin_inbox import show_admin_inbox, count_unread_messages
-from firebase_utils import fetch_all_users, import_students_from_excel_and_csv
-from admin_schedule import show_schedule_main
+from firebase_utils import fetch_users_page, import_students_from_excel_and_csv, roster_upload_key, GRADE_BY_CODE_HEAD
+from admin_schedule import show_schedule_main, process_scheduled_messages_throttled
 from unread_guardian_list import show_unread_guardian_list
+from admin_ai_metrics import show_ai_metrics
+from admin_batch_correction import show_batch_correction
 
 # ---- ページ設定 ----
 st.set_page_config(page_title="管理者メニュー", layout="wide")
@@ -83,73 +85,226 @@ if st.session_state.get("role") != "admin":
 member_id = st.session_state.get("member_id")
 
 # --------------------------------------------
-# 🎉 管理者メニュー（タブ表示）
+# 🎉 管理者メニュー（表示中のビューだけ実行）
 # --------------------------------------------
+# st.tabs は6タブ全部を毎回実行してしまうため、ラジオで選んだビューだけを描画する。
+# refresh_ms はビューごとの自動更新間隔（None は自動更新なし）。
+ADMIN_VIEWS = {
+    "register": {"label": "👥 生徒登録", "refresh_ms": None},
+    "users": {"label": "📋 登録済みユーザー一覧", "refresh_ms": None},
+    "chat": {"label": "💬 チャット管理", "refresh_ms": 5000},
+    "inbox": {"label": "📥 受信ボックス", "refresh_ms": 30000},
+    "schedule": {"label": "⏰ 送信予約", "refresh_ms": 10000},
+    "guardian": {"label": "👀 保護者未読一覧", "refresh_ms": None},
+    "batch": {"label": "📝 一括添削", "refresh_ms": None},
+    "ai": {"label": "📈 AI利用状況", "refresh_ms": None},
+}
 
 st.title(f"📋 管理者メニュー（{member_id}）")
 st.markdown("---")
 
-# 🔥 未読数（リアルタイム）
+# 📩 受信BOXの「開く」→ チャット管理へ切り替え（ラジオ描画前に反映）
+if st.session_state.pop("admin_mode", None) == "チャット管理":
+    st.session_state["admin_view"] = "chat"
+
+# 🔥 未読数（30秒キャッシュ）
 unread = count_unread_messages()
 
-# 🔥 タブ6つ
-tabs = st.tabs([
-    "👥 生徒登録",
-    "📋 登録済みユーザー一覧",
-    "💬 チャット管理",
-    f"📥 受信ボックス（{unread}）",
-    "⏰ 送信予約",
-    "👀 保護者未読一覧"
-])
+
+def _view_label(key: str) -> str:
+    label = ADMIN_VIEWS[key]["label"]
+    return f"{label}（{unread}）" if key == "inbox" else label
+
+
+def _show_import_report(report, upsert: bool):
+    """名簿取込（または取込前の確認）の件数と、更新・スキップした行の見本"""
+    counts = report.counts
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("🆕 新規", counts["新規"])
+    if upsert:
+        c2.metric("✏️ 更新", counts["更新"])
+        c3.metric("＝ 変更なし", counts["変更なし"])
+    else:
+        c2.metric("⏭ 登録済み", counts["登録済み"])
+    c4.metric("⚠ 初期PWなし", counts["初期PWなし"])
+    samples = report.sample_frame()
+    if len(samples) > 0:
+        st.caption(f"更新・スキップする行（先頭 {len(samples)} 件まで）")
+        st.dataframe(samples, use_container_width=True, hide_index=True)
+
+
+view = st.radio(
+    "メニュー",
+    list(ADMIN_VIEWS.keys()),
+    format_func=_view_label,
+    horizontal=True,
+    key="admin_view",
+    label_visibility="collapsed",
+)
+refresh_ms = ADMIN_VIEWS[view]["refresh_ms"]
+st.markdown("---")
+
+# ⏱ 送信予約はどのビューを開いていても一定間隔でチェック
+if view != "schedule":
+    process_scheduled_messages_throttled()
 
 # ------------------------
 # 👥 生徒登録
 # ------------------------
-with tabs[0]:
+if view == "register":
     st.header("👥 生徒登録")
     excel_file = st.file_uploader("📘 Excel（名簿）", type=["xlsx"])
     csv_file = st.file_uploader("📄 CSV（初期PW）", type=["csv"])
+    import_mode = st.radio(
+        "取込モード",
+        ["新規のみ登録", "差分更新（クラス・学年の変更も反映）"],
+        horizontal=True,
+        key="import_mode",
+    )
+    upsert = import_mode != "新規のみ登録"
 
     if excel_file and csv_file:
-        st.info("処理中…")
-        df = import_students_from_excel_and_csv(excel_file, csv_file)
-        if len(df) > 0:
-            st.success("Firestoreへ登録が完了しました！")
-        else:
-            st.warning("登録対象が見つかりませんでした。")
-        st.dataframe(df, use_container_width=True)
+        # ✅ 取込はボタンを押したときだけ。その前に書き込まずに件数を確認する（ファイル・モードごとに1回）
+        job_key = f"{'upsert' if upsert else 'insert'}:{roster_upload_key(excel_file, csv_file)}"
+        jobs = st.session_state.setdefault("import_jobs", {})
+        previews = st.session_state.setdefault("import_previews", {})
+        job = jobs.get(job_key)
+
+        if job is None:
+            preview = previews.get(job_key)
+            if preview is None:
+                try:
+                    with st.spinner("取込内容を確認中…（まだ書き込みません）"):
+                        preview = import_students_from_excel_and_csv(excel_file, csv_file, upsert=upsert, dry_run=True)
+                    previews[job_key] = preview
+                except Exception as e:
+                    st.error(f"❌ 読込エラー: {e}")
+                    st.caption("ファイルを確認して、もう一度アップロードするか画面を更新すると再試行します。")
+
+            if preview is not None:
+                st.subheader("🔍 取込前の確認（まだ書き込んでいません）")
+                _show_import_report(preview, upsert)
+                pending = preview.counts["新規"] + preview.counts["更新"]
+                if pending == 0:
+                    st.info("登録・更新が必要な生徒はいません。")
+                elif st.button(f"📥 取込実行（{pending} 件を書き込む）", type="primary", key="run_import"):
+                    started_at = datetime.now()
+                    try:
+                        with st.spinner("取込中…"):
+                            result = import_students_from_excel_and_csv(excel_file, csv_file, upsert=upsert)
+                    except Exception as e:
+                        # ❌ 失敗したジョブは記録しない（同じファイルでもう一度取り込める）
+                        st.error(f"❌ 取込エラー: {e}")
+                    else:
+                        # ✅ 成功したジョブだけ記録（再描画・自動リフレッシュでは再実行しない）
+                        jobs[job_key] = {
+                            "excel_name": excel_file.name,
+                            "csv_name": csv_file.name,
+                            "started_at": started_at,
+                            "result": result,
+                            "finished_at": datetime.now(),
+                        }
+                        previews.pop(job_key, None)
+                        st.rerun()
+
+        if job is not None:
+            report = job["result"]
+            finished = job["finished_at"].strftime("%H:%M:%S")
+            if report.counts["新規"] + report.counts["更新"] > 0:
+                st.success(f"Firestoreへの取込が完了しました！（{finished} 実行・{job['excel_name']} / {job['csv_name']}）")
+            elif report.total > 0:
+                st.info(f"登録・更新が必要な生徒はいませんでした。（{finished} 実行）")
+            else:
+                st.warning("登録対象が見つかりませんでした。")
+            _show_import_report(report, upsert)
+
+            if st.button("🔁 同じファイルで再取込", key="rerun_import"):
+                jobs.pop(job_key, None)
+                st.rerun()
 
 # ------------------------
 # 📋 登録済みユーザー一覧
 # ------------------------
-with tabs[1]:
+elif view == "users":
     st.header("📋 登録済みユーザー一覧")
-    st.dataframe(fetch_all_users(), use_container_width=True)
+
+    # --- 絞り込み（Firestore 側で where） ---
+    f1, f2, f3, f4 = st.columns([2, 2, 2, 1])
+    with f1:
+        grade_filter = st.selectbox("学年", ["すべて", *GRADE_BY_CODE_HEAD.values()], key="users_grade")
+    with f2:
+        class_filter = st.text_input("クラスコード", key="users_class").strip()
+    with f3:
+        pw_filter = st.selectbox("PW変更", ["すべて", "変更済", "未変更"], key="users_pw")
+    with f4:
+        page_size = st.selectbox("件数", [25, 50, 100], index=1, key="users_page_size")
+
+    filters = {
+        "grade": None if grade_filter == "すべて" else grade_filter,
+        "class_code": class_filter or None,
+        "password_changed": {"すべて": None, "変更済": True, "未変更": False}[pw_filter],
+    }
+
+    # --- カーソル（各ページ先頭の start_after）を積んでページ送り ---
+    filter_key = (tuple(filters.values()), page_size)
+    if st.session_state.get("users_filter_key") != filter_key:
+        st.session_state["users_filter_key"] = filter_key
+        st.session_state["users_cursors"] = [None]
+    cursors = st.session_state["users_cursors"]
+
+    df_users, next_cursor = fetch_users_page(page_size=page_size, start_after=cursors[-1], **filters)
+    st.dataframe(df_users, use_container_width=True)
+
+    p1, p2, p3 = st.columns([1, 2, 1])
+    with p1:
+        if st.button("◀ 前へ", disabled=len(cursors) <= 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with p2:
+        st.caption(f"{len(cursors)} ページ目（{len(df_users)} 件表示）")
+    with p3:
+        if st.button("次へ ▶", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun()
 
 # ------------------------
 # 💬 チャット管理
 # ------------------------
-with tabs[2]:
+elif view == "chat":
     st.header("💬 チャット管理")
-    show_admin_chat()
+    show_admin_chat(refresh_ms=refresh_ms)
 
 # ------------------------
 # 📥 受信BOX
 # ------------------------
-with tabs[3]:
+elif view == "inbox":
     st.header("📥 受信ボックス")
-    show_admin_inbox()
+    show_admin_inbox(refresh_ms=refresh_ms)
 
 # ------------------------
 # ⏰ 送信予約
 # ------------------------
-with tabs[4]:
+elif view == "schedule":
     st.header("⏰ 送信予約")
-    show_schedule_main()
+    show_schedule_main(refresh_ms=refresh_ms)
 
 # ------------------------
 # 👀 保護者未読一覧
 # ------------------------
-with tabs[5]:
+elif view == "guardian":
     st.header("👀 保護者未読一覧")
     show_unread_guardian_list()
+
+# ------------------------
+# 📝 一括添削
+# ------------------------
+elif view == "batch":
+    st.header("📝 一括添削")
+    show_batch_correction()
+
+# ------------------------
+# 📈 AI利用状況
+# ------------------------
+elif view == "ai":
+    st.header("📈 AI利用状況")
+    show_ai_metrics()
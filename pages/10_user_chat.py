@@ -3,7 +3,6 @@
 # =============================================
 
 import streamlit as st
-from firebase_admin import firestore
 from user_chat import show_chat_page, get_user_meta
 
 # --- ページ設定 ---
@@ -28,9 +27,6 @@ if not st.session_state.get("login"):
 
 member_id = st.session_state.get("member_id")
 
-# --- Firebase ---
-db = firestore.client()
-
 # --- ユーザーの学年・クラス取得 ---
 grade, class_name = get_user_meta(member_id)
 grade = grade or "未設定"
@@ -3,11 +3,7 @@
 # =============================================
 
 import streamlit as st
-from firebase_admin import firestore
-from firebase_utils import USERS
-from english_corrector import show_essay_corrector
-from user_chat import show_chat_page, get_user_meta
-from english_conversation import show_english_conversation
+from firebase_utils import USERS, db
 
 # --- ページ設定 ---
 st.set_page_config(page_title="ユーザーホーム", layout="centered")
@@ -33,9 +29,6 @@ if not st.session_state.get("login"):
 
 member_id = st.session_state.get("member_id")
 
-# --- Firestore クライアント ---
-db = firestore.client()
-
 # ===============================
 # 🔍 未読メッセージチェック
 # ===============================
@@ -3,7 +3,6 @@
 # =============================================
 
 import streamlit as st
-from firebase_admin import firestore
 from english_corrector import show_essay_corrector
 
 # --- ページ設定 ---
@@ -28,9 +27,6 @@ if not st.session_state.get("login"):
 
 member_id = st.session_state.get("member_id")
 
-# --- Firestore クライアント（必要なら使用） ---
-db = firestore.client()
-
 # ===============================
 # 📝 英作文添削ページ UI
 # ===============================
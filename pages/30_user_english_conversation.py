@@ -3,7 +3,6 @@
 # =============================================
 
 import streamlit as st
-from firebase_admin import firestore
 from english_conversation import show_english_conversation
 
 # --- ページ設定 ---
@@ -27,9 +26,6 @@ div[data-testid="stAppViewContainer"] > section:first-child {
 if not st.session_state.get("login"):
     st.switch_page("main.py")
 
-# --- Firestore（必要なら利用） ---
-db = firestore.client()
-
 # ===============================
 # 🎧 英会話トレーナー UI
 # ===============================
@@ -4,7 +4,6 @@
 
 import streamlit as st
 from firebase_utils import update_user_password
-from firebase_admin import firestore
 
 # --- ページ設定 ---
 st.set_page_config(page_title="パスワード変更", layout="centered")
@@ -0,0 +1,187 @@
+# =============================================
+# question_pool.py（出題プール：事前生成した問題バンク）
+# =============================================
+# （出題タイプ, レベル）ごとに Firestore の1文書へ問題をまとめて保存しておき、
+# 出題ボタンでは 1 read でまだ見ていない問題を選ぶ。
+# 補充はバックグラウンドスレッド、または refill_question_pool.py（定期実行）で行う。
+#
+# question_pool/{exam|theme}_L{level}
+#   mode, level, updated_at,
+#   items: [{"h": 問題文ハッシュ, "q": 問題文, "created_at": ...}, ...]
+
+import hashlib
+import random
+import re
+import threading
+from datetime import datetime, timezone
+
+# ⚠️ services は gRPC の fork 設定を行うため firebase_admin.firestore より先に import する
+from services import env_int, get_db
+from firebase_admin import firestore
+
+from correction_cache import normalize_text
+from near_duplicate import find_near_duplicate
+from ai_gateway import chat_completion
+
+POOL_COLLECTION = "question_pool"
+MODE_KEYS = {"和文英訳": "exam", "自由英作": "theme"}
+LEVELS = range(1, 11)
+
+POOL_TARGET_SIZE = env_int("QUESTION_POOL_TARGET_SIZE", 60)   # 定期補充でこの件数まで増やす
+POOL_MAX_SIZE = env_int("QUESTION_POOL_MAX_SIZE", 300)        # 超えたら古い問題から捨てる
+POOL_REFILL_BATCH = env_int("QUESTION_POOL_REFILL_BATCH", 20)  # 1回の生成で作る件数
+POOL_MIN_UNSEEN = env_int("QUESTION_POOL_MIN_UNSEEN", 5)       # 未出題がこれ未満なら裏で補充
+
+
+# ==================================================
+# 🔑 ハッシュ・文書ID
+# ==================================================
+def question_hash(text: str) -> str:
+    """問題文の正規化ハッシュ（全角半角・空白の違いは同じ問題とみなす）"""
+    compact = "".join(normalize_text(text).split())
+    return hashlib.sha256(compact.encode("utf-8")).hexdigest()[:16]
+
+
+def _pool_ref(level: int, mode_type: str):
+    return get_db().collection(POOL_COLLECTION).document(f"{MODE_KEYS[mode_type]}_L{int(level)}")
+
+
+# ==================================================
+# 🎯 出題（1 read）
+# ==================================================
+def pick_question(level: int, mode_type: str, seen_hashes=(), seen_texts=()) -> str | None:
+    """プールから未出題の問題を1つ選ぶ。残りが少なければ裏で補充を始める
+
+    seen_texts を渡すと、出題済みの言い換えにあたる問題も避ける。
+    プールが空・全部出題済みのときは None（呼び出し側で直接生成する）。
+    """
+    try:
+        snap = _pool_ref(level, mode_type).get()
+    except Exception as e:
+        print(f"⚠️ 出題プール読込エラー: {e}")
+        return None
+
+    items = (snap.to_dict() or {}).get("items", []) if snap.exists else []
+    seen = set(seen_hashes)
+    unseen = [it for it in items if it.get("h") not in seen and it.get("q")]
+
+    if len(unseen) <= POOL_MIN_UNSEEN:
+        refill_in_background(level, mode_type)
+
+    random.shuffle(unseen)
+    for item in unseen:
+        if not find_near_duplicate(item["q"], seen_texts):
+            return item["q"]
+    return None
+
+
+# ==================================================
+# 🏭 生成・補充
+# ==================================================
+# 指示は system（レベル・問題数によらず同じ）、変わる部分は最後の user に置く（プロンプトキャッシュのため）
+BATCH_SYSTEM_PROMPTS = {
+    "和文英訳": """あなたは英作文問題の作成者です。
+指定された難易度レベルの「和文英訳問題」を指定された数だけ作ってください。
+レベル1は中学英語基礎、レベル10は東大二次試験レベルです。
+題材・文法事項が互いに重ならないようにしてください。
+出力は日本文のみを1行に1問ずつ。番号や説明は付けないでください。""",
+    "自由英作": """あなたは英作文のテーマ作成者です。
+指定された難易度レベルの「自由英作文テーマ」を指定された数だけ作ってください。
+レベル1は簡単な日常会話、レベル10は抽象的・社会的テーマにしてください。
+テーマが互いに重ならないようにしてください。
+出力は英作文テーマを日本語で1行に1問ずつ。番号や説明は付けないでください。""",
+}
+
+
+def _batch_messages(level: int, mode_type: str, count: int) -> list:
+    system = BATCH_SYSTEM_PROMPTS.get(mode_type, BATCH_SYSTEM_PROMPTS["自由英作"])
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"難易度レベル{level}、{count}問"}
+    ]
+
+
+def generate_question_batch(level: int, mode_type: str, count: int = POOL_REFILL_BATCH) -> list[str]:
+    """gpt-4o-mini で問題をまとめて生成（1回の呼び出し）"""
+    response = chat_completion(
+        "question_pool_refill",
+        user_key="system",
+        deadline_sec=180,
+        model="gpt-4o-mini",
+        messages=_batch_messages(level, mode_type, count),
+        temperature=1.0
+    )
+    lines = response.choices[0].message.content.splitlines()
+    # 「1. 」「・」などが付いてきた場合は取り除く
+    return [q for q in (re.sub(r"^\s*(?:\d+[.)．、]|[-・*])\s*", "", line).strip() for line in lines) if q]
+
+
+def add_questions(level: int, mode_type: str, questions: list[str]) -> int:
+    """プールに問題を追加（ハッシュで重複除外）。追加できた件数を返す"""
+    db = get_db()
+    ref = _pool_ref(level, mode_type)
+    now = datetime.now(timezone.utc)
+
+    @firestore.transactional
+    def _merge(transaction):
+        snap = ref.get(transaction=transaction)
+        items = (snap.to_dict() or {}).get("items", []) if snap.exists else []
+        known = {it.get("h") for it in items}
+        texts = [it.get("q") for it in items]
+
+        added = 0
+        for q in questions:
+            h = question_hash(q)
+            # 完全一致（ハッシュ）と言い換え（MinHash）の両方を弾く
+            if h in known or find_near_duplicate(q, texts):
+                continue
+            known.add(h)
+            texts.append(q)
+            items.append({"h": h, "q": q, "created_at": now})
+            added += 1
+
+        transaction.set(ref, {
+            "mode": mode_type,
+            "level": int(level),
+            "items": items[-POOL_MAX_SIZE:],
+            "updated_at": now,
+        })
+        return added
+
+    return _merge(db.transaction())
+
+
+def refill_pool(level: int, mode_type: str, target: int = POOL_TARGET_SIZE) -> int:
+    """プールが target 件になるまで生成して追加。追加した件数を返す"""
+    snap = _pool_ref(level, mode_type).get()
+    size = len((snap.to_dict() or {}).get("items", [])) if snap.exists else 0
+    if size >= target:
+        return 0
+    return add_questions(level, mode_type, generate_question_batch(level, mode_type, target - size))
+
+
+# ==================================================
+# 🧵 バックグラウンド補充（プロセス内で同じプールを二重に補充しない）
+# ==================================================
+_refilling = set()
+_refilling_lock = threading.Lock()
+
+
+def refill_in_background(level: int, mode_type: str):
+    key = (mode_type, int(level))
+    with _refilling_lock:
+        if key in _refilling:
+            return
+        _refilling.add(key)
+
+    def _run():
+        try:
+            added = add_questions(level, mode_type, generate_question_batch(level, mode_type))
+            print(f"✅ 出題プール補充: {mode_type} L{level} +{added}")
+        except Exception as e:
+            print(f"⚠️ 出題プール補充エラー: {e}")
+        finally:
+            with _refilling_lock:
+                _refilling.discard(key)
+
+    threading.Thread(target=_run, name=f"question-pool-{key[0]}-{key[1]}", daemon=True).start()
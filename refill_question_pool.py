@@ -0,0 +1,23 @@
+# =============================================
+# refill_question_pool.py
+# 出題プール補充スクリプト（定期実行：全レベル×出題タイプ）
+# =============================================
+
+from datetime import datetime
+from question_pool import LEVELS, MODE_KEYS, POOL_TARGET_SIZE, refill_pool
+
+
+def refill_all_pools(target: int = POOL_TARGET_SIZE):
+    for mode_type in MODE_KEYS:
+        for level in LEVELS:
+            try:
+                added = refill_pool(level, mode_type, target)
+                print(f"{mode_type} L{level}: +{added}")
+            except Exception as e:
+                print(f"❌ {mode_type} L{level} 補充エラー: {e}")
+
+    print("補充完了 ✔", datetime.now())
+
+
+if __name__ == "__main__":
+    refill_all_pools()
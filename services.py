@@ -0,0 +1,229 @@
+# =============================================
+# services.py（共有サービスレジストリ＋重いモジュールの遅延読込）
+# =============================================
+# Firestore / OpenAI / LangChain などのクライアントをここで1回だけ生成して共有する。
+# 各モジュールは import 時にクライアントを作らず、使う直前に get_*() で取り出す。
+# インスタンスはプロセスごとに持つ（fork した子プロセスでは親のクライアントを使わず作り直す）。
+
+import importlib
+import os
+import threading
+
+# 🍴 fork 後の子プロセスでも gRPC を使えるようにする（grpc の import 前に設定が必要）
+#    無効にしたい場合は環境変数で GRPC_ENABLE_FORK_SUPPORT=false を指定
+#    ページから直接開かれても効くよう、firestore を import するモジュールは
+#    その前に services（または firebase_utils）を import すること
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "true")
+
+import streamlit as st
+from dotenv import load_dotenv
+
+
+# ==================================================
+# 💤 遅延 import
+# ==================================================
+class LazyModule:
+    """最初に属性へアクセスしたときに import されるモジュールの代理"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """例: np = lazy_import("numpy") → np.zeros(...) を初めて呼んだ時点で numpy を読み込む"""
+    return LazyModule(name)
+
+
+# ==================================================
+# 🗂 サービスレジストリ（プロセス単位）
+# ==================================================
+_factories = {}
+_instances = {}
+_instances_pid = os.getpid()
+# ファクトリの中から別サービスを get() しても詰まらないよう RLock
+_lock = threading.RLock()
+
+
+def _forget_parent_instances():
+    """fork 直後の子プロセスで呼ばれる。親のクライアント（gRPC チャネル等）は close せずに手放す"""
+    global _lock, _instances_pid
+    # fork 時に親の別スレッドが握っていたロックは子では解放されないので、先に作り直してから reset する
+    _lock = threading.RLock()
+    reset()
+    _instances_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_parent_instances)
+
+
+def register(name: str, factory):
+    """サービス名とファクトリ（引数なしで生成する関数）を登録"""
+    _factories[name] = factory
+
+
+def get(name: str):
+    """登録済みサービスを取得（プロセスごとに初回だけファクトリを実行してキャッシュ）"""
+    if _instances_pid != os.getpid():
+        # register_at_fork が効かない起動方法の保険
+        _forget_parent_instances()
+    if name in _instances:
+        return _instances[name]
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"未登録のサービスです: {name}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def reset(name: str = None):
+    """キャッシュ済みインスタンスを破棄（name=None で全て）"""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+class ServiceProxy:
+    """モジュール変数として置ける代理。属性アクセスのたびに現在のプロセスの実体へ委譲する
+
+    例: db = ServiceProxy(get_db) → db.collection("users") は get_db().collection("users") と同じ
+    """
+
+    def __init__(self, resolver):
+        self._resolver = resolver
+
+    def __getattr__(self, attr):
+        return getattr(self._resolver(), attr)
+
+    def __repr__(self):
+        return f"<ServiceProxy {self._resolver.__name__}>"
+
+
+# ==================================================
+# 🔑 設定値
+# ==================================================
+def get_openai_api_key() -> str:
+    """① Streamlit Secrets → ② .env の順で OPENAI_API_KEY を探す"""
+    load_dotenv()
+    api_key = None
+    try:
+        if "OPENAI_API_KEY" in st.secrets:
+            api_key = st.secrets["OPENAI_API_KEY"]
+    except Exception:
+        # secrets.toml が無いローカル環境
+        pass
+    if not api_key:
+        api_key = os.getenv("OPENAI_API_KEY")
+
+    if not api_key:
+        st.error("❌ OPENAI_API_KEY が設定されていません。Streamlit Secrets または .env を確認してください。")
+        st.stop()
+    return api_key
+
+
+def env_int(name: str, default: int) -> int:
+    """整数の環境変数（未設定・不正値は default）"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"⚠️ {name} が整数ではないため既定値 {default} を使用します")
+        return default
+
+
+def grpc_channel_options() -> list:
+    """Firestore の gRPC チャネル設定（環境変数で調整可能）
+
+    - FIRESTORE_GRPC_KEEPALIVE_MS          : keepalive ping 間隔（既定 30000）
+    - FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS  : ping 応答待ち（既定 10000）
+    - FIRESTORE_GRPC_MAX_MESSAGE_MB        : 送受信メッセージ上限 MB（既定 -1 = 無制限）
+    """
+    max_mb = env_int("FIRESTORE_GRPC_MAX_MESSAGE_MB", -1)
+    max_bytes = max_mb * 1024 * 1024 if max_mb > 0 else -1
+    return [
+        ("grpc.keepalive_time_ms", env_int("FIRESTORE_GRPC_KEEPALIVE_MS", 30000)),
+        ("grpc.keepalive_timeout_ms", env_int("FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS", 10000)),
+        ("grpc.max_send_message_length", max_bytes),
+        ("grpc.max_receive_message_length", max_bytes),
+    ]
+
+
+def _openai_http_client():
+    """OpenAI 用の httpx 接続プール（環境変数で調整可能）
+
+    - OPENAI_MAX_CONNECTIONS    : 同時接続数（既定 20）
+    - OPENAI_MAX_KEEPALIVE      : 待機させておく接続数（既定 10）
+    - OPENAI_TIMEOUT_SEC        : リクエストのタイムアウト秒（既定 60）
+    """
+    import httpx
+    from openai import DefaultHttpxClient
+
+    limits = httpx.Limits(
+        max_connections=env_int("OPENAI_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=env_int("OPENAI_MAX_KEEPALIVE", 10),
+    )
+    return DefaultHttpxClient(limits=limits, timeout=env_int("OPENAI_TIMEOUT_SEC", 60))
+
+
+# ==================================================
+# 🏭 ファクトリ
+# ==================================================
+def _create_firestore():
+    # 🔁 循環import対策：関数内で遅延インポート（初期化は firebase_utils.init_firebase に一本化）
+    from firebase_utils import init_firebase
+    return init_firebase()
+
+
+def _create_openai():
+    from openai import OpenAI
+    # 再試行は ai_gateway がバックオフ付きで行うので SDK 側では行わない
+    return OpenAI(api_key=get_openai_api_key(), http_client=_openai_http_client(), max_retries=0)
+
+
+def _create_chat_llm():
+    from langchain_openai import ChatOpenAI
+    # --- ✅ Pydanticエラー回避 ---
+    ChatOpenAI.model_rebuild()
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0.6,
+        api_key=get_openai_api_key(),
+        http_client=_openai_http_client(),
+        max_retries=0,
+        stream_usage=True,  # ストリーミングでもトークン数を受け取る（ai_metrics 用）
+    )
+
+
+register("firestore", _create_firestore)
+register("openai", _create_openai)
+register("chat_llm", _create_chat_llm)
+
+
+def get_db():
+    """Firestore クライアント"""
+    return get("firestore")
+
+
+def get_openai_client():
+    """OpenAI クライアント（chat / vision / Whisper 共通）"""
+    return get("openai")
+
+
+def get_chat_llm():
+    """英会話用 LangChain ChatOpenAI"""
+    return get("chat_llm")
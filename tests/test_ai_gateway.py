@@ -0,0 +1,107 @@
+# =============================================
+# tests/test_ai_gateway.py（FairRateLimiter：順番・締切・同時実行数）
+# =============================================
+# 実際のモデルは呼ばず、流量制限の部分だけを複数スレッドで確かめる。
+
+import threading
+import time
+
+import pytest
+
+from ai_gateway import AIGatewayError, FairRateLimiter
+
+
+def _limiter(max_concurrency=1, rate_per_sec=1000.0, burst=100) -> FairRateLimiter:
+    return FairRateLimiter(max_concurrency=max_concurrency, rate_per_sec=rate_per_sec, burst=burst)
+
+
+def _queued(limiter: FairRateLimiter) -> int:
+    with limiter._cond:
+        return sum(len(q) for q in limiter._queues.values())
+
+
+def _wait_until(cond, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > end:
+            raise AssertionError("待ち状態になりませんでした")
+        time.sleep(0.005)
+
+
+def test_waiting_users_are_served_round_robin():
+    limiter = _limiter()
+    limiter.acquire("holder", time.monotonic() + 5)  # 枠を埋めておき、待ち行列を作る
+
+    order = []
+
+    def worker(user):
+        limiter.acquire(user, time.monotonic() + 5)
+        order.append(user)
+        limiter.release()
+
+    threads = []
+    # A が3件連打してから B・C が1件ずつ並ぶ
+    for user in ["A", "A", "A", "B", "C"]:
+        t = threading.Thread(target=worker, args=(user,))
+        t.start()
+        threads.append(t)
+        _wait_until(lambda n=len(threads): _queued(limiter) == n)
+
+    limiter.release()
+    for t in threads:
+        t.join(timeout=5)
+
+    # A の連打で B・C が後回しにならない
+    assert order == ["A", "B", "C", "A", "A"]
+
+
+def test_acquire_gives_up_at_deadline_and_leaves_the_queue():
+    limiter = _limiter()
+    limiter.acquire("holder", time.monotonic() + 5)
+
+    started = time.monotonic()
+    with pytest.raises(AIGatewayError):
+        limiter.acquire("late", started + 0.05)
+    assert time.monotonic() - started < 1
+    assert _queued(limiter) == 0
+
+    # 締切切れの待ちが残っていなければ、枠が空いた後の呼び出しはすぐ通る
+    limiter.release()
+    limiter.acquire("next", time.monotonic() + 0.5)
+    limiter.release()
+
+
+def test_token_bucket_limits_bursts():
+    limiter = _limiter(max_concurrency=10, rate_per_sec=0.1, burst=2)
+    for _ in range(2):
+        limiter.acquire("u", time.monotonic() + 0.5)
+        limiter.release()
+    with pytest.raises(AIGatewayError):
+        limiter.acquire("u", time.monotonic() + 0.05)
+
+
+def test_concurrency_never_exceeds_the_cap():
+    limiter = _limiter(max_concurrency=2)
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def worker(i):
+        nonlocal active, peak
+        limiter.acquire(f"user{i % 3}", time.monotonic() + 5)
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        limiter.release()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert peak == 2
+    assert limiter._active == 0
@@ -0,0 +1,103 @@
+# =============================================
+# tests/test_audio_pipeline.py（録音リングバッファと発話区間の切り出し）
+# =============================================
+
+import io
+import wave
+
+import numpy as np
+
+from audio_pipeline import CAPTURE_SAMPLE_RATE, PCMRingBuffer, UtteranceSegmenter
+
+RATE = CAPTURE_SAMPLE_RATE
+
+
+def _tone(seconds: float) -> np.ndarray:
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (np.sin(2 * np.pi * 220 * t) * 6000).astype(np.int16)
+
+
+def _silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(RATE * seconds), dtype=np.int16)
+
+
+def _feed(segmenter: UtteranceSegmenter, *parts, block: int = 320):
+    """WebRTC と同じく細切れ（既定 20ms）で流し込む"""
+    pcm = np.concatenate(parts)
+    for i in range(0, len(pcm), block):
+        segmenter.feed(pcm[i:i + block])
+
+
+def _durations(uploads) -> list[float]:
+    out = []
+    for _name, data, _mime in uploads:
+        with wave.open(io.BytesIO(data)) as wf:
+            out.append(wf.getnframes() / wf.getframerate())
+    return out
+
+
+# ---------- PCMRingBuffer ----------
+def test_ring_buffer_keeps_order_across_wraparound():
+    buf = PCMRingBuffer(8)
+    buf.write(np.arange(5, dtype=np.int16))
+    buf.write(np.arange(5, 11, dtype=np.int16))  # 3 サンプル溢れて先頭に折り返す
+
+    assert len(buf) == 8
+    assert buf.dropped == 3
+    with buf.drain() as pcm:
+        assert pcm.tolist() == list(range(3, 11))
+    assert len(buf) == 0
+
+
+def test_ring_buffer_write_larger_than_capacity_keeps_newest():
+    buf = PCMRingBuffer(4)
+    buf.write(np.arange(3, dtype=np.int16))
+    buf.write(np.arange(10, 20, dtype=np.int16))
+
+    with buf.drain() as pcm:
+        assert pcm.tolist() == [16, 17, 18, 19]
+
+
+# ---------- UtteranceSegmenter ----------
+def test_utterance_is_cut_after_trailing_silence():
+    seg = UtteranceSegmenter()
+    _feed(seg, _silence(0.5), _tone(1.0), _silence(1.0))
+
+    [duration] = _durations(seg.take_utterances())
+    # 前後の無音は preroll / hangover の分だけ残る
+    assert 1.0 <= duration <= 1.6
+    assert seg.take_utterances() == []
+
+
+def test_long_speech_is_split_at_the_buffer_cap():
+    seg = UtteranceSegmenter(max_seconds=5)
+    _feed(seg, _silence(0.5), _tone(7.0), _silence(1.0))
+
+    durations = _durations(seg.take_utterances())
+    assert len(durations) == 2
+    assert durations[0] == 5.0
+    assert 1.5 <= durations[1] <= 2.5
+
+
+def test_short_noise_is_dropped():
+    seg = UtteranceSegmenter()
+    _feed(seg, _silence(0.5), _tone(0.15), _silence(1.0))
+
+    assert seg.take_utterances() == []
+
+
+def test_finish_sends_the_utterance_in_progress():
+    seg = UtteranceSegmenter()
+    _feed(seg, _silence(0.3), _tone(1.0))
+    assert seg.take_utterances() == []
+
+    seg.finish()
+    assert len(seg.take_utterances()) == 1
+
+
+def test_input_is_ignored_while_muted():
+    seg = UtteranceSegmenter()
+    seg.mute(60)
+    _feed(seg, _silence(0.3), _tone(1.0), _silence(1.0))
+
+    assert seg.take_utterances() == []
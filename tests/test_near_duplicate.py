@@ -0,0 +1,47 @@
+# =============================================
+# tests/test_near_duplicate.py（問題文の近似重複チェックの判定例）
+# =============================================
+# near_duplicate.py の冒頭に書いた「拾う／拾わない」組をそのまま確かめる。
+
+import pytest
+
+from near_duplicate import DUP_THRESHOLD, find_near_duplicate, similarity
+
+# 近似重複として弾くべき組（表記ゆれ・助詞・語順・指示文の言い回しだけが違う）
+DUPLICATE_PAIRS = [
+    ("私は毎朝公園を走ります。", "私は毎朝、公園で走ります"),
+    ("私は毎朝公園を走ります。", "私は 毎朝 公園を 走ります!"),
+    ("昨日、彼は駅で古い友人に会った。", "彼は昨日駅で古い友人に会った。"),
+    ("この本は私が今まで読んだ中で一番面白い。", "この本は私が今までに読んだ中で最も面白い。"),
+    ("好きな季節について英語で書きなさい", "あなたの好きな季節について、英語で書いてください。"),
+    ("将来の夢について、あなたの考えを英語で述べなさい。", "あなたの将来の夢について英語で述べてください"),
+]
+
+# 別の問題として通すべき組（指示文は同じで題材だけ違う／同義語への言い換え）
+DISTINCT_PAIRS = [
+    ("好きな季節について英語で書きなさい", "好きな食べ物について英語で書きなさい"),
+    ("好きなスポーツについて英語で書きなさい", "好きな映画について英語で書きなさい"),
+    ("あなたの将来の夢について英語で述べなさい", "あなたの家族について英語で述べなさい"),
+    ("SNSの利点と欠点について、あなたの考えを英語で述べなさい。",
+     "制服の利点と欠点について、あなたの考えを英語で述べなさい。"),
+    ("週末に何をするのが好きですか。英語で書きなさい", "夏休みに何をしたいですか。英語で書きなさい"),
+    ("私は毎朝公園を走ります。", "私は毎晩図書館で勉強します。"),
+    ("私は毎朝走る。", "私は毎朝ジョギングする。"),
+]
+
+
+@pytest.mark.parametrize("text_a, text_b", DUPLICATE_PAIRS)
+def test_near_duplicates_are_caught(text_a, text_b):
+    assert similarity(text_a, text_b) >= DUP_THRESHOLD
+    assert find_near_duplicate(text_a, ["", text_b]) == text_b
+
+
+@pytest.mark.parametrize("text_a, text_b", DISTINCT_PAIRS)
+def test_distinct_questions_pass(text_a, text_b):
+    assert similarity(text_a, text_b) < DUP_THRESHOLD
+    assert find_near_duplicate(text_a, [text_b]) is None
+
+
+def test_frame_only_questions_are_not_all_equal():
+    # 定型部分しか無い文でも、空文字どうしの一致にはしない
+    assert similarity("英語で書きなさい", "英語に訳しなさい") < 1.0
@@ -0,0 +1,95 @@
+# =============================================
+# tests/test_roster_import.py（名簿取込：差分の計算と件数）
+# =============================================
+# Firestore には書き込まない（dry_run、または _commit_in_batches を差し替えて渡された内容を見る）。
+
+import pandas as pd
+import pytest
+
+import firebase_utils
+from firebase_utils import ROSTER_SYNC_FIELDS, RosterImportReport, _register_roster_frame
+
+
+def _roster(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["member_id", "name", "class_code"])
+
+
+def _passwords(ids) -> pd.DataFrame:
+    return pd.DataFrame({"member_id": list(ids), "init_pw": [f"pw{i}" for i in ids]})
+
+
+def _existing(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["member_id", *ROSTER_SYNC_FIELDS]).set_index("member_id")
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    calls = []
+    monkeypatch.setattr(firebase_utils, "_commit_in_batches",
+                        lambda docs, updates=None: calls.append((docs, updates or {})))
+    return calls
+
+
+EXISTING = _existing([
+    ("1001", "山田 太郎", "10101", "中1"),
+    ("1002", "佐藤 花子", "10101", "中1"),
+    ("1003", "鈴木 一郎", "20101", "中2"),
+])
+
+
+def test_upsert_diff_counts_and_changed_fields(commits):
+    roster = _roster([
+        ("1001", "山田 太郎", "10101"),   # 変更なし
+        ("1002", "佐藤 花子", "20101"),   # 進級：クラス・学年が変わる
+        ("1003", "鈴木 一朗", "20101"),   # 氏名の訂正
+        ("1004", "田中 次郎", "30101"),   # 新規
+        ("1005", "高橋 三郎", "30101"),   # 新規だが初期PWなし
+    ])
+    report = RosterImportReport()
+    _register_roster_frame(roster, _passwords(["1001", "1002", "1003", "1004"]), report, EXISTING)
+
+    assert report.counts == {"新規": 1, "更新": 2, "変更なし": 1, "登録済み": 0, "初期PWなし": 1}
+
+    [(docs, updates)] = commits
+    assert list(docs) == ["1004"]
+    assert docs["1004"]["grade"] == "中3"
+    assert updates == {"1002": {"class_code": "20101", "grade": "中2"}, "1003": {"name": "鈴木 一朗"}}
+
+    samples = report.sample_frame().set_index("会員番号")
+    assert samples.at["1002", "変更項目"] == "class_code: 10101→20101, grade: 中1→中2"
+    assert samples.at["1005", "処理"] == "初期PWなし"
+
+
+def test_dry_run_counts_without_writing(commits):
+    roster = _roster([("1002", "佐藤 花子", "20101"), ("1004", "田中 次郎", "30101")])
+    report = RosterImportReport()
+    _register_roster_frame(roster, _passwords(["1002", "1004"]), report, EXISTING, dry_run=True)
+
+    assert report.counts["新規"] == 1
+    assert report.counts["更新"] == 1
+    assert commits == []
+
+
+def test_chunks_use_the_first_row_for_repeated_member_ids(commits):
+    report = RosterImportReport()
+    seen = set()
+    pw = _passwords(["1002", "1004"])
+    _register_roster_frame(_roster([("1004", "田中 次郎", "30101")]), pw, report, EXISTING, seen)
+    # 後のチャンクに同じ会員番号が出ても、新規登録し直したり更新したりしない
+    _register_roster_frame(_roster([("1004", "田中 二郎", "40101"), ("1002", "佐藤 花子", "10101")]),
+                           pw, report, EXISTING, seen)
+
+    assert report.counts == {"新規": 1, "更新": 0, "変更なし": 1, "登録済み": 0, "初期PWなし": 0}
+    assert seen == {"1002", "1004"}
+    assert [list(docs) for docs, _ in commits] == [["1004"], []]
+
+
+def test_report_keeps_only_a_capped_sample(monkeypatch, commits):
+    monkeypatch.setattr(firebase_utils, "ROSTER_REPORT_SAMPLE_ROWS", 3)
+    existing = _existing([(str(2000 + i), "生徒", "10101", "中1") for i in range(10)])
+    roster = _roster([(str(2000 + i), "生徒", "20101") for i in range(10)])
+    report = RosterImportReport()
+    _register_roster_frame(roster, _passwords([]), report, existing)
+
+    assert report.counts["更新"] == 10
+    assert len(report.sample_frame()) == 3
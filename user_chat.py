@@ -5,9 +5,7 @@
 import streamlit as st
 from firebase_utils import db  # ✅ Cloud／ローカル共通の接続
 from datetime import datetime, timezone
-from streamlit_autorefresh import st_autorefresh
 import pytz
-from firebase_admin import firestore
 from google.cloud import firestore
 
 
@@ -237,31 +235,40 @@ def _render_message(user_id: str, msg: dict):
 
 
 # ==================================================
-# 🔹 チャットUI
+# 🔹 メッセージ一覧（この部分だけを定期再実行）
 # ==================================================
-def show_chat_page(user_id: str, grade: str = None, class_name: str = None):
-    st.title("チャット")
-
-    st_autorefresh(interval=5000, key="chat_refresh")
-
+def _show_message_list(user_id: str, grade: str = None, class_name: str = None):
     messages = get_all_messages(user_id, grade, class_name)
     if not messages:
         st.info("まだメッセージはありません。")
-    else:
-        recent = messages[:3]      # 新しい3件
-        older = messages[3:]       # それ以前
+        return
+
+    recent = messages[:3]      # 新しい3件
+    older = messages[3:]       # それ以前
 
-        # ✅ 過去履歴を上部へ
-        if older:
-            with st.expander(f"📜 過去の履歴を表示（{len(older)}件）"):
-                for msg in reversed(older):
-                    _render_message(user_id, msg)
+    # ✅ 過去履歴を上部へ
+    if older:
+        with st.expander(f"📜 過去の履歴を表示（{len(older)}件）"):
+            for msg in reversed(older):
+                _render_message(user_id, msg)
 
-        st.markdown("### 📌 直近3件")
+    st.markdown("### 📌 直近3件")
+
+    # ✅ 直近3件は「古い→新しい」順で下に新しいメッセージが来るように逆順表示
+    for msg in reversed(recent):
+        _render_message(user_id, msg)
+
+
+# ==================================================
+# 🔹 チャットUI
+# ==================================================
+def show_chat_page(user_id: str, grade: str = None, class_name: str = None, refresh_ms: int = 5000):
+    """refresh_ms: メッセージ一覧の自動更新間隔（ミリ秒）。None / 0 で自動更新しない"""
+    st.title("チャット")
 
-        # ✅ 直近3件は「古い→新しい」順で下に新しいメッセージが来るように逆順表示
-        for msg in reversed(recent):
-            _render_message(user_id, msg)
+    # 🔁 一覧だけを fragment で再実行（送信欄・ページ全体は再実行しない）
+    run_every = refresh_ms / 1000 if refresh_ms else None
+    st.fragment(_show_message_list, run_every=run_every)(user_id, grade, class_name)
 
     st.markdown("---")
 